@@ -1,30 +1,112 @@
-from dotenv import load_dotenv
+import time
 from os import getenv
 
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Blueprint, Flask, Response, abort, current_app, g, request
+from flask import jsonify as flask_jsonify
 from flask_cors import CORS
-from flask_migrate import Migrate
-
-from models import db, setup_db, Actor, Movie, Role
-from helpers.dates import convert_date_to_dateobj
+from sqlalchemy.orm import joinedload
+
+from models import db, setup_db, bulk_insert, insert_roles, Actor, Movie, Role
+from helpers.export import EXPORT_FORMATS, export_statement, stream_export
+from helpers.fields import load_fields
+from helpers.pagination import keyset_columns, order_by_keyset, paginate
+from helpers.streaming import STREAM_CHUNK_SIZE, stream_json_list
+from helpers.validation import (
+    validate_actor,
+    validate_actor_update,
+    validate_movie,
+    validate_movie_update
+)
+from resources import (
+    ACTOR_FIELD_COLUMNS,
+    ACTOR_RELATIONSHIPS,
+    ACTOR_SORT_COLUMNS,
+    MOVIE_FIELD_COLUMNS,
+    MOVIE_RELATIONSHIPS,
+    MOVIE_SORT_COLUMNS,
+    actor_row,
+    apply_actor_payload,
+    apply_movie_payload,
+    bulk_response,
+    filter_actors,
+    filter_movies,
+    get_actor_ids_payload,
+    get_bulk_payload,
+    get_page_params,
+    get_projection_params,
+    get_search_params,
+    get_sort_params,
+    movie_row,
+    prepare_bulk_rows,
+    stream_requested
+)
 from auth.auth import requires_auth
+from cache import conditional, response_cache
+from metrics import (
+    REQUEST_DURATION,
+    REQUEST_PHASE_DURATION,
+    registry,
+    start_request_phases,
+    stop_request_phases,
+    timed_phase
+)
+from search import search_column
+
+
+api = Blueprint('api', __name__)
 
 
-load_dotenv()
+def create_app(config=None):
+    """Create and configure the app
 
+    config -- settings overriding the ones read from the environment, such as
+              SQLALCHEMY_DATABASE_URI (optional)
 
-def create_app(test_db=None):
-    # create and configure the app
+    Importing this module configures nothing: gunicorn builds the app with
+    `app:create_app()`, and the flask CLI finds this factory itself.
+    """
     app = Flask(__name__)
+    app.config['UNPAGINATED_LISTS'] = getenv(
+        'UNPAGINATED_LISTS', '').lower() == 'true'
+    app.config['BULK_MAX_BATCH_SIZE'] = int(getenv('BULK_MAX_BATCH_SIZE', 1000))
+    app.config['METRICS_ENABLED'] = getenv(
+        'METRICS_ENABLED', '').lower() == 'true'
+    app.config.update(config or {})
+
     CORS(app)
-    setup_db(app, test_db)
-    migrate = Migrate(app, db)
+    setup_db(app)
+    app.register_blueprint(api)
+
+    # Flask-Migrate imports Alembic, which only the `flask db` commands need, so
+    # it is only set up when the app is loaded by the flask CLI
+    if getenv('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
 
     return app
 
 
-APP = create_app()
+def jsonify(*args, **kwargs):
+    """`flask.jsonify`, timed as the `encode` phase of the request"""
+    with timed_phase('encode'):
+        return flask_jsonify(*args, **kwargs)
+
+
+def format_rows(rows, fields, expand):
+    """Serialize each model in `rows`, timed as the `serialize` phase of the request"""
+    with timed_phase('serialize'):
+        return [row.format(fields, expand) for row in rows]
+
+
+def bulk_create(model, data, validate, to_row, date_fields=()):
+    """Validate every record in `data`, then insert the valid ones together
+
+    Returns the response for a bulk create endpoint, with the id or validation
+    error of each record in the same position as the record in the payload.
+    """
+    results, rows = prepare_bulk_rows(data, validate, to_row, date_fields)
+
+    return jsonify(bulk_response(results, bulk_insert(model, rows)))
 
 
 ########
@@ -33,19 +115,104 @@ APP = create_app()
 ########
 
 
-@APP.route('/actors')
+@api.route('/actors')
 @requires_auth('read:actors')
+@conditional('actors', 'movies', 'roles')
+@response_cache.cached('actors', 'movies', 'roles')
 def get_actors():
-    """Return a list of all actors"""
+    """Return a page of actors, ordered by id unless another `sort` is requested
+
+    Query parameters:
+    gender -- only return actors with this gender (optional)
+    name -- only return actors whose name starts with this, ignoring case (optional)
+    min_age -- only return actors at least this old (optional)
+    max_age -- only return actors at most this old (optional)
+    sort -- `id` (default), `name` or `date_of_birth`, prefixed with `-` to sort descending (optional)
+    limit -- the maximum number of actors to return (optional)
+    after -- the `next_cursor` returned with the previous page (optional)
+    fields -- comma separated fields to return for each actor, e.g. `id,name` (optional)
+    expand -- `none` (default) to leave out the actor's movies, `ids` to return their ids, or
+              `nested` to return the movies themselves (optional)
+    stream -- if `true`, every matching actor is streamed back in a single chunked response,
+              and `limit` and `after` are ignored (optional)
+
+    Returns an object, with the actors on the page and the `next_cursor` to request
+    the following page with (null on the last page).
+    """
+
+    fields, expand = get_projection_params(request.args, Actor, ACTOR_RELATIONSHIPS, 'none')
+    sort_column, descending = get_sort_params(request.args, ACTOR_SORT_COLUMNS)
+    columns = keyset_columns(Actor.id, sort_column)
+
+    # Only select the requested columns, and load every actor's movies (if
+    # requested) in one batched query, rather than one per actor
+    query = filter_actors(load_fields(
+        Actor.query, ACTOR_FIELD_COLUMNS, fields, ACTOR_RELATIONSHIPS, expand, extra_columns=columns), request.args)
+
+    if stream_requested(request.args):
+        return stream_json_list(
+            'actors',
+            order_by_keyset(query, columns, descending).yield_per(
+                STREAM_CHUNK_SIZE),
+            lambda actor: actor.format(fields, expand)
+        )
+
+    limit, after = get_page_params(
+        request.args, columns, current_app.config['UNPAGINATED_LISTS'])
+    if limit is None:
+        return jsonify({
+            'success': True,
+            'actors': format_rows(order_by_keyset(query, columns, descending).all(), fields, expand)
+        })
+
+    actors, next_cursor = paginate(
+        query, Actor.id, limit, after, sort_column, descending)
+
+    return jsonify({
+        'success': True,
+        'actors': format_rows(actors, fields, expand),
+        'next_cursor': next_cursor
+    })
+
+
+@api.route('/actors/<int:actor_id>')
+@requires_auth('read:actors')
+@conditional('actors', 'movies', 'roles')
+@response_cache.cached('actors', 'movies', 'roles')
+def get_actor(actor_id):
+    """Return a single actor
+
+    Query parameters:
+    fields -- comma separated fields to return, e.g. `id,name` (optional)
+    expand -- `none` to leave out the actor's movies, `ids` to return their ids, or
+              `nested` (default) to return the movies themselves (optional)
+
+    Returns an object, with the actor if it exists.
+    """
+
+    fields, expand = get_projection_params(request.args, Actor, ACTOR_RELATIONSHIPS, 'nested')
+
+    # The actor and its movies are read in a single joined query
+    actor = load_fields(
+        Actor.query, ACTOR_FIELD_COLUMNS, fields, ACTOR_RELATIONSHIPS, expand,
+        loader=joinedload, extra_columns=[Actor.id]
+    ).filter(Actor.id == actor_id).one_or_none()
+    if not actor:
+        abort(
+            404, description=f'Actor with actor_id {actor_id} was not found.')
+
+    with timed_phase('serialize'):
+        actor = actor.format(fields, expand)
 
     return jsonify({
         'success': True,
-        'actors': [a.format() for a in Actor.query.all()]
+        'actor': actor
     })
 
 
-@APP.route('/actors', methods=['POST'])
+@api.route('/actors', methods=['POST'])
 @requires_auth('create:actors')
+@response_cache.invalidates('actors')
 def create_actor():
     """Add a new actor to the database
 
@@ -58,20 +225,11 @@ def create_actor():
     """
 
     data = request.get_json()
-    if not data or not data.get('name'):
-        abort(400, description='`name` attribute must be specified')
-
-    if data.get('date_of_birth') and convert_date_to_dateobj(data['date_of_birth']) == None:
-        abort(400, description="`date_of_birth` must be in format YYYY-MM-DD")
-
-    actor = Actor(name=data['name'])
-
-    if data.get('date_of_birth'):
-        actor.date_of_birth = data['date_of_birth']
-
-    if data.get('gender'):
-        actor.gender = data['gender']
+    error = validate_actor(data)
+    if error:
+        abort(400, description=error)
 
+    actor = apply_actor_payload(Actor(), data)
     actor.insert()
 
     return jsonify({
@@ -80,8 +238,31 @@ def create_actor():
     })
 
 
-@APP.route('/actors/<int:actor_id>', methods=['PATCH'])
+@api.route('/actors/bulk', methods=['POST'])
+@requires_auth('create:actors')
+@response_cache.invalidates('actors')
+def create_actors():
+    """Add many actors to the database in a single transaction
+
+    Payload:
+    A list of actors, each with the same parameters accepted by `POST /actors`.
+
+    Every actor is validated before anything is inserted. Valid actors are inserted,
+    and invalid actors are skipped.
+    Returns an object, with a result for each actor in the payload holding either
+    the id of the new actor, or the reason it was not inserted.
+    """
+
+    data = get_bulk_payload(
+        request.get_json(), current_app.config['BULK_MAX_BATCH_SIZE'])
+
+    return bulk_create(
+        Actor, data, validate_actor, actor_row, date_fields=['date_of_birth'])
+
+
+@api.route('/actors/<int:actor_id>', methods=['PATCH'])
 @requires_auth('update:actors')
+@response_cache.invalidates('actors')
 def update_actor(actor_id):
     """Updates an existing actor's information in the database
 
@@ -95,26 +276,16 @@ def update_actor(actor_id):
     """
 
     data = request.get_json()
-    if not data or not (data.get('name') or data.get('date_of_birth') or data.get('gender')):
-        abort(400, description='At least one of `name`, `date_of_birth`, or `gender` must be provided.')
-
-    if data.get('date_of_birth') and convert_date_to_dateobj(data['date_of_birth']) == None:
-        abort(400, description="`date_of_birth` must be in format YYYY-MM-DD")
+    error = validate_actor_update(data)
+    if error:
+        abort(400, description=error)
 
     actor = Actor.query.get(actor_id)
     if not actor:
         abort(
             404, description=f'Actor with actor_id {actor_id} was not found.')
 
-    if data.get('name'):
-        actor.name = data['name']
-
-    if data.get('date_of_birth'):
-        actor.date_of_birth = data['date_of_birth']
-
-    if data.get('gender'):
-        actor.gender = data['gender']
-
+    apply_actor_payload(actor, data)
     actor.update()
 
     return jsonify({
@@ -123,8 +294,9 @@ def update_actor(actor_id):
     })
 
 
-@APP.route('/actors/<int:actor_id>', methods=['DELETE'])
+@api.route('/actors/<int:actor_id>', methods=['DELETE'])
 @requires_auth('delete:actors')
+@response_cache.invalidates('actors', 'roles')
 def delete_actor(actor_id):
     """Deletes an existing actor from the database
 
@@ -149,19 +321,103 @@ def delete_actor(actor_id):
 # /movies
 ########
 
-@APP.route('/movies')
+@api.route('/movies')
 @requires_auth('read:movies')
+@conditional('actors', 'movies', 'roles')
+@response_cache.cached('actors', 'movies', 'roles')
 def get_movies():
-    """Return a list of all movies"""
+    """Return a page of movies, ordered by id unless another `sort` is requested
+
+    Query parameters:
+    title -- only return movies whose title starts with this, ignoring case (optional)
+    release_date_from -- only return movies released on or after this YYYY-MM-DD date (optional)
+    release_date_to -- only return movies released on or before this YYYY-MM-DD date (optional)
+    sort -- `id` (default), `title` or `release_date`, prefixed with `-` to sort descending (optional)
+    limit -- the maximum number of movies to return (optional)
+    after -- the `next_cursor` returned with the previous page (optional)
+    fields -- comma separated fields to return for each movie, e.g. `id,title` (optional)
+    expand -- `none` (default) to leave out the movie's actors, `ids` to return their ids, or
+              `nested` to return the actors themselves (optional)
+    stream -- if `true`, every matching movie is streamed back in a single chunked response,
+              and `limit` and `after` are ignored (optional)
+
+    Returns an object, with the movies on the page and the `next_cursor` to request
+    the following page with (null on the last page).
+    """
+
+    fields, expand = get_projection_params(request.args, Movie, MOVIE_RELATIONSHIPS, 'none')
+    sort_column, descending = get_sort_params(request.args, MOVIE_SORT_COLUMNS)
+    columns = keyset_columns(Movie.id, sort_column)
+
+    # Only select the requested columns, and load every movie's cast (if
+    # requested) in one batched query, rather than one per movie
+    query = filter_movies(load_fields(
+        Movie.query, MOVIE_FIELD_COLUMNS, fields, MOVIE_RELATIONSHIPS, expand, extra_columns=columns), request.args)
+
+    if stream_requested(request.args):
+        return stream_json_list(
+            'movies',
+            order_by_keyset(query, columns, descending).yield_per(
+                STREAM_CHUNK_SIZE),
+            lambda movie: movie.format(fields, expand)
+        )
+
+    limit, after = get_page_params(
+        request.args, columns, current_app.config['UNPAGINATED_LISTS'])
+    if limit is None:
+        return jsonify({
+            'success': True,
+            'movies': format_rows(order_by_keyset(query, columns, descending).all(), fields, expand)
+        })
+
+    movies, next_cursor = paginate(
+        query, Movie.id, limit, after, sort_column, descending)
 
     return jsonify({
         'success': True,
-        'movies': [m.format() for m in Movie.query.all()]
+        'movies': format_rows(movies, fields, expand),
+        'next_cursor': next_cursor
     })
 
 
-@APP.route('/movies', methods=['POST'])
+@api.route('/movies/<int:movie_id>')
+@requires_auth('read:movies')
+@conditional('actors', 'movies', 'roles')
+@response_cache.cached('actors', 'movies', 'roles')
+def get_movie(movie_id):
+    """Return a single movie
+
+    Query parameters:
+    fields -- comma separated fields to return, e.g. `id,title` (optional)
+    expand -- `none` to leave out the movie's actors, `ids` to return their ids, or
+              `nested` (default) to return the actors themselves (optional)
+
+    Returns an object, with the movie if it exists.
+    """
+
+    fields, expand = get_projection_params(request.args, Movie, MOVIE_RELATIONSHIPS, 'nested')
+
+    # The movie and its cast are read in a single joined query
+    movie = load_fields(
+        Movie.query, MOVIE_FIELD_COLUMNS, fields, MOVIE_RELATIONSHIPS, expand,
+        loader=joinedload, extra_columns=[Movie.id]
+    ).filter(Movie.id == movie_id).one_or_none()
+    if not movie:
+        abort(
+            404, description=f'Unable to find the specified movie_id: {movie_id}')
+
+    with timed_phase('serialize'):
+        movie = movie.format(fields, expand)
+
+    return jsonify({
+        'success': True,
+        'movie': movie
+    })
+
+
+@api.route('/movies', methods=['POST'])
 @requires_auth('create:movies')
+@response_cache.invalidates('movies')
 def create_movie():
     """Add a new movie to the database
 
@@ -173,16 +429,11 @@ def create_movie():
     """
 
     data = request.get_json()
-    if not data or not data.get('title'):
-        abort(400, description='`title` attribute must be provided.')
-
-    if data.get('release_date') and convert_date_to_dateobj(data['release_date']) == None:
-        abort(400, description='`release_date` must be in format YYYY-MM-DD')
-
-    movie = Movie(title=data['title'])
-    if data.get('release_date'):
-        movie.release_date = data['release_date']
+    error = validate_movie(data)
+    if error:
+        abort(400, description=error)
 
+    movie = apply_movie_payload(Movie(), data)
     movie.insert()
 
     return jsonify({
@@ -191,8 +442,31 @@ def create_movie():
     })
 
 
-@APP.route('/movies/<int:movie_id>', methods=['PATCH'])
+@api.route('/movies/bulk', methods=['POST'])
+@requires_auth('create:movies')
+@response_cache.invalidates('movies')
+def create_movies():
+    """Add many movies to the database in a single transaction
+
+    Payload:
+    A list of movies, each with the same parameters accepted by `POST /movies`.
+
+    Every movie is validated before anything is inserted. Valid movies are inserted,
+    and invalid movies are skipped.
+    Returns an object, with a result for each movie in the payload holding either
+    the id of the new movie, or the reason it was not inserted.
+    """
+
+    data = get_bulk_payload(
+        request.get_json(), current_app.config['BULK_MAX_BATCH_SIZE'])
+
+    return bulk_create(
+        Movie, data, validate_movie, movie_row, date_fields=['release_date'])
+
+
+@api.route('/movies/<int:movie_id>', methods=['PATCH'])
 @requires_auth('update:movies')
+@response_cache.invalidates('movies')
 def update_movie(movie_id):
     """Updates an existing movie's information in the database
 
@@ -205,24 +479,16 @@ def update_movie(movie_id):
     """
 
     data = request.get_json()
-    if not data or not (data.get('title') or data.get('release_date')):
-        abort(
-            400, description='Either `title` or `release_date` attribute must be specified')
-
-    if data.get('release_date') and convert_date_to_dateobj(data['release_date']) == None:
-        abort(400, description='`release_date` must be in format YYYY-MM-DD')
+    error = validate_movie_update(data)
+    if error:
+        abort(400, description=error)
 
     movie = Movie.query.get(movie_id)
     if not movie:
         abort(
             404, description=f'Unable to find the specified movie_id: {movie_id}')
 
-    if data.get('title'):
-        movie.title = data['title']
-
-    if data.get('release_date'):
-        movie.release_date = data['release_date']
-
+    apply_movie_payload(movie, data)
     movie.update()
 
     return jsonify({
@@ -231,8 +497,9 @@ def update_movie(movie_id):
     })
 
 
-@APP.route('/movies/<int:movie_id>', methods=['DELETE'])
+@api.route('/movies/<int:movie_id>', methods=['DELETE'])
 @requires_auth('delete:movies')
+@response_cache.invalidates('movies', 'roles')
 def delete_movie(movie_id):
     """Deletes an existing movie from the database
 
@@ -252,8 +519,9 @@ def delete_movie(movie_id):
     })
 
 
-@APP.route('/movies/<int:movie_id>/actors', methods=['POST'])
+@api.route('/movies/<int:movie_id>/actors', methods=['POST'])
 @requires_auth('create:role')
+@response_cache.invalidates('roles')
 def add_actor_to_movie(movie_id):
     """Add an actor to a movie in the database
 
@@ -279,23 +547,59 @@ def add_actor_to_movie(movie_id):
         abort(
             404, description=f'Unable to find the specified actor_id: {actor_id}')
 
-    existing_role = Role.query.filter(
-        Role.movie_id == movie_id and Role.actor_id == actor_id).one_or_none()
-    if existing_role:
+    # The roles primary key rejects duplicates, so the conflict check and insert
+    # happen in a single statement
+    if not insert_roles(movie_id, [actor_id]):
         abort(
             409, description=f'`actor_id`: {actor_id} already has a role in `movie_id`: {movie_id}')
 
-    role = Role(movie_id=movie_id, actor_id=actor_id)
-    role.insert()
-
     return jsonify({
         'success': True,
         'movie': movie.format()
     })
 
 
-@APP.route('/movies/<int:movie_id>/actors/<int:actor_id>', methods=['DELETE'])
+@api.route('/movies/<int:movie_id>/actors/bulk', methods=['POST'])
+@requires_auth('create:role')
+@response_cache.invalidates('roles')
+def add_actors_to_movie(movie_id):
+    """Add many actors to a movie in the database
+
+    Payload parameters:
+    actor_ids -- list of ids of the actors being added to the movie (required)
+
+    Returns an object, with the ids of the actors that were added, that already had
+    a role in the movie, and that could not be found.
+    """
+
+    actor_ids = get_actor_ids_payload(
+        request.get_json(), current_app.config['BULK_MAX_BATCH_SIZE'])
+
+    movie = Movie.query.get(movie_id)
+    if not movie:
+        abort(
+            404, description=f'Unable to find the specified movie_id: {movie_id}')
+
+    found = {actor_id for (actor_id,) in db.session.query(
+        Actor.id).filter(Actor.id.in_(actor_ids))}
+    existing = {actor_id for (actor_id,) in db.session.query(Role.actor_id).filter(
+        Role.movie_id == movie_id, Role.actor_id.in_(found))}
+
+    added = insert_roles(
+        movie_id, [a for a in actor_ids if a in found and a not in existing])
+
+    return jsonify({
+        'success': True,
+        'movie_id': movie_id,
+        'added': [a for a in actor_ids if a in added],
+        'duplicates': [a for a in actor_ids if a in found and a not in added],
+        'missing': [a for a in actor_ids if a not in found]
+    })
+
+
+@api.route('/movies/<int:movie_id>/actors/<int:actor_id>', methods=['DELETE'])
 @requires_auth('delete:role')
+@response_cache.invalidates('roles')
 def remove_actor_from_movie(movie_id, actor_id):
     """Remove an actor from a movie in the database
 
@@ -328,11 +632,162 @@ def remove_actor_from_movie(movie_id, actor_id):
     })
 
 
+########
+# Search endpoints
+# /search
+########
+
+@api.route('/search')
+@requires_auth(['read:actors', 'read:movies'])
+@conditional('actors', 'movies')
+@response_cache.cached('actors', 'movies')
+def search():
+    """Search actors by name and movies by title, including partial matches
+
+    Query parameters:
+    q -- the text to search for (required)
+    type -- `actors` or `movies`, to only search one of them (optional)
+    limit -- the maximum number of actors and of movies to return (optional)
+    offset -- the number of best matches to skip, to fetch later pages (optional)
+
+    Returns an object, with the matching actors and movies ranked by score, best first.
+    """
+
+    query, search_type, limit, offset = get_search_params(request.args)
+
+    response = {
+        'success': True,
+        'q': query
+    }
+    if search_type in (None, 'actors'):
+        response['actors'] = [
+            {'id': actor_id, 'name': name, 'score': round(score, 3)}
+            for actor_id, name, score in search_column(Actor.name, query, limit, offset)
+        ]
+    if search_type in (None, 'movies'):
+        response['movies'] = [
+            {'id': movie_id, 'title': title, 'score': round(score, 3)}
+            for movie_id, title, score in search_column(Movie.title, query, limit, offset)
+        ]
+
+    return jsonify(response)
+
+
+########
+# Export endpoints
+# /export
+########
+
+def export_table(table, *order_by):
+    """Stream every row of `table` back in the format requested by the client"""
+
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_FORMATS:
+        abort(
+            400, description=f"`format` must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    statement = export_statement(
+        table, order_by, export_format, db.engine.dialect.name)
+    result = db.session.execute(statement.execution_options(stream_results=True))
+
+    gzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+    return stream_export(result, export_format, gzip)
+
+
+@api.route('/export/actors')
+@requires_auth('read:actors')
+def export_actors():
+    """Export every actor, one row per actor
+
+    Query parameters:
+    format -- `ndjson` (default) or `csv` (optional)
+
+    The response is gzip encoded if the client accepts it.
+    """
+
+    return export_table(Actor.__table__, Actor.id)
+
+
+@api.route('/export/movies')
+@requires_auth('read:movies')
+def export_movies():
+    """Export every movie, one row per movie
+
+    Query parameters:
+    format -- `ndjson` (default) or `csv` (optional)
+
+    The response is gzip encoded if the client accepts it.
+    """
+
+    return export_table(Movie.__table__, Movie.id)
+
+
+@api.route('/export/roles')
+@requires_auth(['read:actors', 'read:movies'])
+def export_roles():
+    """Export every role, one row per actor_id and movie_id pair
+
+    Query parameters:
+    format -- `ndjson` (default) or `csv` (optional)
+
+    The response is gzip encoded if the client accepts it.
+    """
+
+    return export_table(Role.__table__, Role.movie_id, Role.actor_id)
+
+
+########
+# Metrics endpoint
+# /metrics
+########
+
+@api.before_app_request
+def start_request_timer():
+    if current_app.config['METRICS_ENABLED']:
+        g.request_start = time.perf_counter()
+        start_request_phases()
+
+
+@api.after_app_request
+def record_request_metrics(response):
+    """Record the request's latency, and its time in each phase, under its route
+
+    Requests are labelled with the route's rule (e.g. `/actors/<int:actor_id>`)
+    rather than the path, so the number of series stays fixed.
+    """
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_DURATION.observe(
+        time.perf_counter() - start, request.method, route, response.status_code)
+    for phase, seconds in stop_request_phases().items():
+        REQUEST_PHASE_DURATION.observe(seconds, route, phase)
+
+    return response
+
+
+@api.route('/metrics')
+def metrics():
+    """Return the app's metrics in the Prometheus text format
+
+    Not authenticated, so that Prometheus can scrape it, and only served when
+    METRICS_ENABLED is set.
+    """
+
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404, description='Metrics are not enabled.')
+
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
 ########
 # Error handlers
 ########
 
-@APP.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     return jsonify({
         'success': False,
@@ -341,7 +796,7 @@ def bad_request(error):
     }), 400
 
 
-@APP.errorhandler(401)
+@api.app_errorhandler(401)
 def not_authorized(error):
     return jsonify({
         'success': False,
@@ -350,7 +805,7 @@ def not_authorized(error):
     }), 401
 
 
-@APP.errorhandler(403)
+@api.app_errorhandler(403)
 def access_forbidden(error):
     return jsonify({
         'success': False,
@@ -359,7 +814,7 @@ def access_forbidden(error):
     }), 403
 
 
-@APP.errorhandler(404)
+@api.app_errorhandler(404)
 def resource_not_found(error):
     return jsonify({
         'success': False,
@@ -368,7 +823,7 @@ def resource_not_found(error):
     }), 404
 
 
-@APP.errorhandler(409)
+@api.app_errorhandler(409)
 def resource_conflict(error):
     return jsonify({
         'success': False,
@@ -378,4 +833,4 @@ def resource_conflict(error):
 
 
 if __name__ == '__main__':
-    APP.run(host='0.0.0.0', port=9000, debug=True)
+    create_app().run(host='0.0.0.0', port=9000, debug=True)
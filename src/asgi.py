@@ -0,0 +1,960 @@
+"""ASGI entry point, serving the casting API on asyncio
+
+Serves the same routes, error responses and permissions as the Flask app in
+`app.py`, sharing its models, validation and request parsing (`resources.py`).
+Queries run on an async SQLAlchemy session (asyncpg for Postgres, aiosqlite for
+SQLite), so a request waiting on the database, or on a slow client, does not
+hold a thread, and one process can serve thousands of connections at once.
+
+Needs the packages in requirements-asgi.txt. Run from the `src` directory with:
+uvicorn --factory asgi:create_app --host 0.0.0.0 --port 8000
+
+Reads answer with the same ETags as the Flask app and share its response
+cache, and writes bump the same table versions, so both apps can run against
+the same database.
+"""
+import json
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+from os import getenv
+
+from flask import abort
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags, quote_etag
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.exceptions import HTTPException as StarletteHTTPException
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.responses import JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+except ImportError as error:
+    raise ImportError(
+        'The ASGI app needs the packages in requirements-asgi.txt') from error
+
+from models import (
+    add_roles,
+    bump_table_versions_statement,
+    get_database_uri,
+    get_pool_options,
+    insert_rows,
+    metrics_engine,
+    table_versions_statement,
+    InstrumentedAsyncQueuePool,
+    Actor,
+    Movie,
+    Role
+)
+from helpers.export import (
+    EXPORT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    export_encoder,
+    export_headers,
+    export_statement,
+    gzip_compressor
+)
+from helpers.fields import load_fields
+from helpers.pagination import keyset_columns, order_by_keyset, page_queries, split_page
+from helpers.streaming import STREAM_CHUNK_SIZE, encode_json_rows, json_list_head
+from helpers.validation import (
+    validate_actor,
+    validate_actor_update,
+    validate_movie,
+    validate_movie_update
+)
+from resources import (
+    ACTOR_FIELD_COLUMNS,
+    ACTOR_RELATIONSHIPS,
+    ACTOR_SORT_COLUMNS,
+    MOVIE_FIELD_COLUMNS,
+    MOVIE_RELATIONSHIPS,
+    MOVIE_SORT_COLUMNS,
+    actor_row,
+    apply_actor_payload,
+    apply_movie_payload,
+    bulk_response,
+    filter_actors,
+    filter_movies,
+    get_actor_ids_payload,
+    get_bulk_payload,
+    get_page_params,
+    get_projection_params,
+    get_search_params,
+    get_sort_params,
+    movie_row,
+    prepare_bulk_rows,
+    stream_requested
+)
+from auth.auth import (
+    check_permissions,
+    compile_permissions,
+    parse_authorization_header,
+    verify_token
+)
+from auth.token_cache import token_cache
+from cache import make_etag, response_cache
+from metrics import (
+    REQUEST_DURATION,
+    REQUEST_PHASE_DURATION,
+    registry,
+    start_request_phases,
+    stop_request_phases,
+    timed_phase
+)
+from search import search_column
+
+
+# The async driver used for each database scheme
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite'
+}
+
+
+def get_async_database_uri(database_uri):
+    """Returns `database_uri` with the scheme of its async driver"""
+    scheme, separator, rest = database_uri.partition('://')
+    dialect = scheme.split('+')[0]
+    return ASYNC_DRIVERS.get(dialect, scheme) + separator + rest
+
+
+########
+# Request handling
+########
+
+def requires_auth(permission='', any_of=None):
+    """Require a valid bearer token for the decorated endpoint
+
+    The same checks as `auth.auth.requires_auth`. Tokens missing from the token
+    cache are verified on a worker thread, as verifying may fetch the signing
+    keys from Auth0.
+    """
+    required = compile_permissions(permission)
+    alternatives = compile_permissions(any_of)
+
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(request):
+            with timed_phase('auth'):
+                token = parse_authorization_header(
+                    request.headers.get('Authorization'))
+                verified = token_cache.get(token)
+                if verified is None:
+                    verified = await run_in_threadpool(verify_token, token)
+
+                payload, permissions = verified
+                check_permissions(required, permissions, alternatives)
+                request.state.permissions = permissions
+
+            return await f(request)
+
+        return wrapper
+    return requires_auth_decorator
+
+
+def with_session(f):
+    """Pass the decorated endpoint a database session, closed when the request ends
+
+    Anything not committed by the endpoint is rolled back.
+    """
+    @wraps(f)
+    async def wrapper(request):
+        async with request.app.state.sessionmaker() as session:
+            return await f(request, session)
+
+    return wrapper
+
+
+def invalidates(*namespaces):
+    """Invalidate cached responses built from `namespaces` once the decorated write succeeds
+
+    The generations are bumped on a worker thread, as the backend may be Redis.
+    """
+    def invalidates_decorator(f):
+        @wraps(f)
+        async def wrapper(request):
+            response = await f(request)
+            await run_in_threadpool(response_cache.invalidate, *namespaces)
+            return response
+
+        return wrapper
+    return invalidates_decorator
+
+
+def query_items(request):
+    """Returns the query parameters sorted as the Flask app sorts them for its
+    cache keys and ETags, so both apps agree on them
+    """
+    return sorted(request.query_params.multi_items())
+
+
+def conditional(*tables):
+    """Add an ETag to the decorated GET endpoint, and answer If-None-Match with 304
+
+    The same ETags as `cache.conditional`, read from the table versions on a
+    session of its own, so a matching request never runs the endpoint.
+    """
+    def conditional_decorator(f):
+        @wraps(f)
+        async def wrapper(request):
+            if stream_requested(request.query_params):
+                return await f(request)
+
+            async with request.app.state.sessionmaker() as session:
+                result = await session.execute(table_versions_statement(tables))
+                versions = dict(result.all())
+
+            etag = make_etag(
+                request.url.path, query_items(request),
+                [versions.get(table, 0) for table in tables])
+
+            if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+                return Response(status_code=304, headers={'ETag': quote_etag(etag)})
+
+            response = await f(request)
+            if response.status_code == 200:
+                response.headers['ETag'] = quote_etag(etag)
+            return response
+
+        return wrapper
+    return conditional_decorator
+
+
+def cached(*namespaces):
+    """Serve the decorated GET endpoint from the response cache when possible
+
+    The same cache entries as `ResponseCache.cached`. The cache is read and
+    written on a worker thread, as the backend may be Redis.
+    """
+    def cached_decorator(f):
+        @wraps(f)
+        async def wrapper(request):
+            if response_cache.backend is None or stream_requested(request.query_params):
+                return await f(request)
+
+            key = await run_in_threadpool(
+                response_cache.get_key,
+                request.url.path,
+                query_items(request),
+                sorted(request.state.permissions),
+                namespaces
+            )
+            entry = await run_in_threadpool(response_cache.get, key)
+            if entry is not None:
+                mimetype, body = entry
+                return Response(body, media_type=mimetype, headers={'X-Cache': 'HIT'})
+
+            response = await f(request)
+            if response.status_code == 200 and not isinstance(response, StreamingResponse):
+                await run_in_threadpool(
+                    response_cache.set, key, response.media_type, response.body)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
+    return cached_decorator
+
+
+async def get_json(request):
+    """Returns the JSON payload of the request, or None if there is no body"""
+    body = await request.body()
+    if not body:
+        return None
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        abort(400, description='Payload must be valid JSON.')
+
+
+async def bump_table_versions(session, *names):
+    await session.execute(bump_table_versions_statement(names))
+
+
+async def get_or_404(session, model, key, description, options=()):
+    instance = await session.get(model, key, options=list(options))
+    if not instance:
+        abort(404, description=description)
+
+    return instance
+
+
+async def list_response(request, session, name, query, key_column, sort_column, descending, serialize):
+    """Build the response of a list endpoint, with one page of `query`"""
+    columns = keyset_columns(key_column, sort_column)
+    limit, after = get_page_params(
+        request.query_params, columns, request.app.state.unpaginated_lists)
+    if limit is None:
+        result = await session.execute(order_by_keyset(query, columns, descending))
+        with timed_phase('serialize'):
+            rows = [serialize(row) for row in result.scalars().all()]
+
+        return JSONResponse({
+            'success': True,
+            name: rows
+        })
+
+    # One row more than `limit` is read, to tell whether there is a following page
+    rows = []
+    for page_query in page_queries(query, key_column, after, sort_column, descending):
+        result = await session.execute(page_query.limit(limit + 1 - len(rows)))
+        rows.extend(result.scalars().all())
+        if len(rows) > limit:
+            break
+
+    rows, next_cursor = split_page(rows, key_column, limit, sort_column)
+    with timed_phase('serialize'):
+        rows = [serialize(row) for row in rows]
+
+    return JSONResponse({
+        'success': True,
+        name: rows,
+        'next_cursor': next_cursor
+    })
+
+
+def stream_list(request, name, query, columns, descending, serialize):
+    """Stream every row of `query` back in a single chunked response, like
+    `helpers.streaming.stream_json_list`
+
+    Rows are read STREAM_CHUNK_SIZE at a time on a session of their own, which
+    stays open until the whole response has been sent.
+    """
+    statement = order_by_keyset(query, columns, descending).execution_options(
+        yield_per=STREAM_CHUNK_SIZE)
+
+    async def generate():
+        yield json_list_head(name)
+
+        separator = ''
+        async with request.app.state.sessionmaker() as session:
+            result = await session.stream(statement)
+            async for rows in result.scalars().partitions(STREAM_CHUNK_SIZE):
+                yield separator + encode_json_rows(rows, serialize)
+                separator = ','
+
+        yield ']}'
+
+    return StreamingResponse(generate(), media_type='application/json')
+
+
+async def load_actor(session, actor_id, fields=Actor.DEFAULT_FIELDS, expand='nested'):
+    """Read an actor and its movies in a single joined query, or None if it does not exist
+
+    Loaded attributes are refreshed, so an actor written earlier in the session is
+    returned as it is now stored.
+    """
+    query = load_fields(
+        select(Actor), ACTOR_FIELD_COLUMNS, fields, ACTOR_RELATIONSHIPS, expand,
+        loader=joinedload, extra_columns=[Actor.id]
+    ).where(Actor.id == actor_id).execution_options(populate_existing=True)
+
+    result = await session.execute(query)
+    return result.unique().scalar_one_or_none()
+
+
+async def load_movie(session, movie_id, fields=Movie.DEFAULT_FIELDS, expand='nested'):
+    """Read a movie and its cast in a single joined query, or None if it does not exist"""
+    query = load_fields(
+        select(Movie), MOVIE_FIELD_COLUMNS, fields, MOVIE_RELATIONSHIPS, expand,
+        loader=joinedload, extra_columns=[Movie.id]
+    ).where(Movie.id == movie_id).execution_options(populate_existing=True)
+
+    result = await session.execute(query)
+    return result.unique().scalar_one_or_none()
+
+
+########
+# Actor endpoints
+# /actors
+########
+
+@requires_auth('read:actors')
+@conditional('actors', 'movies', 'roles')
+@cached('actors', 'movies', 'roles')
+@with_session
+async def get_actors(request, session):
+    """Return a page of actors, or all of them with `stream=true`, with the same
+    query parameters as `GET /actors` in the Flask app
+    """
+    args = request.query_params
+
+    fields, expand = get_projection_params(args, Actor, ACTOR_RELATIONSHIPS, 'none')
+    sort_column, descending = get_sort_params(args, ACTOR_SORT_COLUMNS)
+    columns = keyset_columns(Actor.id, sort_column)
+
+    query = filter_actors(load_fields(
+        select(Actor), ACTOR_FIELD_COLUMNS, fields, ACTOR_RELATIONSHIPS, expand, extra_columns=columns), args)
+
+    def serialize(actor):
+        return actor.format(fields, expand)
+
+    if stream_requested(args):
+        return stream_list(request, 'actors', query, columns, descending, serialize)
+
+    return await list_response(
+        request, session, 'actors', query, Actor.id, sort_column, descending, serialize)
+
+
+@requires_auth('read:actors')
+@conditional('actors', 'movies', 'roles')
+@cached('actors', 'movies', 'roles')
+@with_session
+async def get_actor(request, session):
+    actor_id = request.path_params['actor_id']
+    fields, expand = get_projection_params(
+        request.query_params, Actor, ACTOR_RELATIONSHIPS, 'nested')
+
+    actor = await load_actor(session, actor_id, fields, expand)
+    if not actor:
+        abort(
+            404, description=f'Actor with actor_id {actor_id} was not found.')
+
+    with timed_phase('serialize'):
+        actor = actor.format(fields, expand)
+
+    return JSONResponse({
+        'success': True,
+        'actor': actor
+    })
+
+
+@requires_auth('create:actors')
+@invalidates('actors')
+@with_session
+async def create_actor(request, session):
+    data = await get_json(request)
+    error = validate_actor(data)
+    if error:
+        abort(400, description=error)
+
+    actor = apply_actor_payload(Actor(), data)
+    session.add(actor)
+    await bump_table_versions(session, 'actors')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'actor': (await load_actor(session, actor.id)).format()
+    })
+
+
+@requires_auth('create:actors')
+@invalidates('actors')
+@with_session
+async def create_actors(request, session):
+    data = get_bulk_payload(
+        await get_json(request), request.app.state.bulk_max_batch_size)
+
+    results, rows = prepare_bulk_rows(
+        data, validate_actor, actor_row, date_fields=['date_of_birth'])
+    ids = await session.run_sync(insert_rows, Actor, rows)
+    await session.commit()
+
+    return JSONResponse(bulk_response(results, ids))
+
+
+@requires_auth('update:actors')
+@invalidates('actors')
+@with_session
+async def update_actor(request, session):
+    actor_id = request.path_params['actor_id']
+    data = await get_json(request)
+    error = validate_actor_update(data)
+    if error:
+        abort(400, description=error)
+
+    actor = await get_or_404(
+        session, Actor, actor_id, f'Actor with actor_id {actor_id} was not found.')
+
+    apply_actor_payload(actor, data)
+    await bump_table_versions(session, 'actors')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'actor': (await load_actor(session, actor_id)).format()
+    })
+
+
+@requires_auth('delete:actors')
+@invalidates('actors', 'roles')
+@with_session
+async def delete_actor(request, session):
+    actor_id = request.path_params['actor_id']
+
+    # Deleting the actor deletes its roles, so they are loaded up front rather
+    # than lazily, which an async session cannot do
+    actor = await get_or_404(
+        session, Actor, actor_id, f'Actor with actor_id {actor_id} was not found.',
+        options=[selectinload(Actor.movies)])
+
+    await session.delete(actor)
+    await bump_table_versions(session, 'actors', 'roles')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'actor_id': actor_id
+    })
+
+
+########
+# Movie endpoints
+# /movies
+########
+
+@requires_auth('read:movies')
+@conditional('actors', 'movies', 'roles')
+@cached('actors', 'movies', 'roles')
+@with_session
+async def get_movies(request, session):
+    """Return a page of movies, or all of them with `stream=true`, with the same
+    query parameters as `GET /movies` in the Flask app
+    """
+    args = request.query_params
+
+    fields, expand = get_projection_params(args, Movie, MOVIE_RELATIONSHIPS, 'none')
+    sort_column, descending = get_sort_params(args, MOVIE_SORT_COLUMNS)
+    columns = keyset_columns(Movie.id, sort_column)
+
+    query = filter_movies(load_fields(
+        select(Movie), MOVIE_FIELD_COLUMNS, fields, MOVIE_RELATIONSHIPS, expand, extra_columns=columns), args)
+
+    def serialize(movie):
+        return movie.format(fields, expand)
+
+    if stream_requested(args):
+        return stream_list(request, 'movies', query, columns, descending, serialize)
+
+    return await list_response(
+        request, session, 'movies', query, Movie.id, sort_column, descending, serialize)
+
+
+@requires_auth('read:movies')
+@conditional('actors', 'movies', 'roles')
+@cached('actors', 'movies', 'roles')
+@with_session
+async def get_movie(request, session):
+    movie_id = request.path_params['movie_id']
+    fields, expand = get_projection_params(
+        request.query_params, Movie, MOVIE_RELATIONSHIPS, 'nested')
+
+    movie = await load_movie(session, movie_id, fields, expand)
+    if not movie:
+        abort(
+            404, description=f'Unable to find the specified movie_id: {movie_id}')
+
+    with timed_phase('serialize'):
+        movie = movie.format(fields, expand)
+
+    return JSONResponse({
+        'success': True,
+        'movie': movie
+    })
+
+
+@requires_auth('create:movies')
+@invalidates('movies')
+@with_session
+async def create_movie(request, session):
+    data = await get_json(request)
+    error = validate_movie(data)
+    if error:
+        abort(400, description=error)
+
+    movie = apply_movie_payload(Movie(), data)
+    session.add(movie)
+    await bump_table_versions(session, 'movies')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'movie': (await load_movie(session, movie.id)).format()
+    })
+
+
+@requires_auth('create:movies')
+@invalidates('movies')
+@with_session
+async def create_movies(request, session):
+    data = get_bulk_payload(
+        await get_json(request), request.app.state.bulk_max_batch_size)
+
+    results, rows = prepare_bulk_rows(
+        data, validate_movie, movie_row, date_fields=['release_date'])
+    ids = await session.run_sync(insert_rows, Movie, rows)
+    await session.commit()
+
+    return JSONResponse(bulk_response(results, ids))
+
+
+@requires_auth('update:movies')
+@invalidates('movies')
+@with_session
+async def update_movie(request, session):
+    movie_id = request.path_params['movie_id']
+    data = await get_json(request)
+    error = validate_movie_update(data)
+    if error:
+        abort(400, description=error)
+
+    movie = await get_or_404(
+        session, Movie, movie_id, f'Unable to find the specified movie_id: {movie_id}')
+
+    apply_movie_payload(movie, data)
+    await bump_table_versions(session, 'movies')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'movie': (await load_movie(session, movie_id)).format()
+    })
+
+
+@requires_auth('delete:movies')
+@invalidates('movies', 'roles')
+@with_session
+async def delete_movie(request, session):
+    movie_id = request.path_params['movie_id']
+    movie = await get_or_404(
+        session, Movie, movie_id, f'Unable to find the specified movie_id: {movie_id}',
+        options=[selectinload(Movie.actors)])
+
+    await session.delete(movie)
+    await bump_table_versions(session, 'movies', 'roles')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'movie_id': movie_id
+    })
+
+
+@requires_auth('create:role')
+@invalidates('roles')
+@with_session
+async def add_actor_to_movie(request, session):
+    movie_id = request.path_params['movie_id']
+    data = await get_json(request)
+    if not data or not data.get('actor_id'):
+        abort(400, description='`actor_id` attribute must be specified')
+
+    actor_id = data['actor_id']
+
+    await get_or_404(
+        session, Movie, movie_id, f'Unable to find the specified movie_id: {movie_id}')
+    await get_or_404(
+        session, Actor, actor_id, f'Unable to find the specified actor_id: {actor_id}')
+
+    if not await session.run_sync(add_roles, movie_id, [actor_id]):
+        abort(
+            409, description=f'`actor_id`: {actor_id} already has a role in `movie_id`: {movie_id}')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'movie': (await load_movie(session, movie_id)).format()
+    })
+
+
+@requires_auth('create:role')
+@invalidates('roles')
+@with_session
+async def add_actors_to_movie(request, session):
+    movie_id = request.path_params['movie_id']
+    actor_ids = get_actor_ids_payload(
+        await get_json(request), request.app.state.bulk_max_batch_size)
+
+    await get_or_404(
+        session, Movie, movie_id, f'Unable to find the specified movie_id: {movie_id}')
+
+    found = set((await session.execute(
+        select(Actor.id).where(Actor.id.in_(actor_ids)))).scalars())
+    existing = set((await session.execute(select(Role.actor_id).where(
+        Role.movie_id == movie_id, Role.actor_id.in_(found)))).scalars())
+
+    added = await session.run_sync(
+        add_roles, movie_id, [a for a in actor_ids if a in found and a not in existing])
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'movie_id': movie_id,
+        'added': [a for a in actor_ids if a in added],
+        'duplicates': [a for a in actor_ids if a in found and a not in added],
+        'missing': [a for a in actor_ids if a not in found]
+    })
+
+
+@requires_auth('delete:role')
+@invalidates('roles')
+@with_session
+async def remove_actor_from_movie(request, session):
+    movie_id = request.path_params['movie_id']
+    actor_id = request.path_params['actor_id']
+
+    await get_or_404(
+        session, Movie, movie_id, f'Unable to find the specified movie_id: {movie_id}')
+    await get_or_404(
+        session, Actor, actor_id, f'Unable to find the specified actor_id: {actor_id}')
+
+    role = await session.get(Role, (actor_id, movie_id))
+    if not role:
+        abort(
+            404, description=f'`actor_id`: {actor_id} is not currently listed as having a role in `movie_id`: {movie_id}')
+
+    await session.delete(role)
+    await bump_table_versions(session, 'roles')
+    await session.commit()
+
+    return JSONResponse({
+        'success': True,
+        'movie_id': movie_id,
+        'actor_id': actor_id
+    })
+
+
+########
+# Search endpoints
+# /search
+########
+
+@requires_auth(['read:actors', 'read:movies'])
+@conditional('actors', 'movies')
+@cached('actors', 'movies')
+@with_session
+async def search(request, session):
+    query, search_type, limit, offset = get_search_params(request.query_params)
+
+    async def search_in(column):
+        return await session.run_sync(
+            lambda sync_session: search_column(column, query, limit, offset, session=sync_session))
+
+    response = {
+        'success': True,
+        'q': query
+    }
+    if search_type in (None, 'actors'):
+        response['actors'] = [
+            {'id': actor_id, 'name': name, 'score': round(score, 3)}
+            for actor_id, name, score in await search_in(Actor.name)
+        ]
+    if search_type in (None, 'movies'):
+        response['movies'] = [
+            {'id': movie_id, 'title': title, 'score': round(score, 3)}
+            for movie_id, title, score in await search_in(Movie.title)
+        ]
+
+    return JSONResponse(response)
+
+
+########
+# Export endpoints
+# /export
+########
+
+async def gzip_stream(chunks):
+    """Compress an async stream of text chunks into a gzip stream on the fly"""
+    compressor = gzip_compressor()
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def export_table(request, table, *order_by):
+    """Stream every row of `table` back in the format requested by the client,
+    like `helpers.export.stream_export`
+
+    Rows are read EXPORT_CHUNK_SIZE at a time from a server side cursor, on a
+    connection of its own, which stays open until the whole export has been sent.
+    """
+    export_format = request.query_params.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_FORMATS:
+        abort(
+            400, description=f"`format` must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    statement = export_statement(
+        table, order_by, export_format, request.app.state.engine.dialect.name)
+    gzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+
+    async def generate():
+        async with request.app.state.engine.connect() as connection:
+            result = await connection.stream(statement)
+            header, encode = export_encoder(list(result.keys()), export_format)
+            if header:
+                yield header
+
+            async for rows in result.partitions(EXPORT_CHUNK_SIZE):
+                yield encode(rows)
+
+    body = gzip_stream(generate()) if gzip else generate()
+
+    return StreamingResponse(
+        body, media_type=EXPORT_FORMATS[export_format], headers=export_headers(gzip))
+
+
+@requires_auth('read:actors')
+async def export_actors(request):
+    return export_table(request, Actor.__table__, Actor.id)
+
+
+@requires_auth('read:movies')
+async def export_movies(request):
+    return export_table(request, Movie.__table__, Movie.id)
+
+
+@requires_auth(['read:actors', 'read:movies'])
+async def export_roles(request):
+    return export_table(request, Role.__table__, Role.movie_id, Role.actor_id)
+
+
+########
+# Metrics endpoint
+# /metrics
+########
+
+class RequestMetricsMiddleware:
+    """Record each request's latency, and its time in each phase, under its route
+
+    The metrics recorded by the Flask app's `record_request_metrics`, with routes
+    labelled by their path template (e.g. `/actors/{actor_id:int}`).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        start_request_phases()
+        status = 500
+
+        async def send_recording_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_recording_status)
+        finally:
+            route = ROUTE_PATHS.get(scope.get('endpoint'), 'unmatched')
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start, scope['method'], route, status)
+            for phase, seconds in stop_request_phases().items():
+                REQUEST_PHASE_DURATION.observe(seconds, route, phase)
+
+
+async def metrics(request):
+    """Return the app's metrics in the Prometheus text format
+
+    Not authenticated, so that Prometheus can scrape it, and only served when
+    METRICS_ENABLED is set.
+    """
+    if not request.app.state.metrics_enabled:
+        abort(404, description='Metrics are not enabled.')
+
+    metrics_engine.set(request.app.state.engine.sync_engine)
+    return Response(registry.render(), media_type='text/plain; version=0.0.4')
+
+
+########
+# Error handlers
+########
+
+async def http_error(request, error):
+    """Return the same JSON error body as the Flask app's error handlers"""
+    if isinstance(error, HTTPException):
+        status, message = error.code, error.description
+    else:
+        status, message = error.status_code, error.detail
+
+    return JSONResponse({
+        'success': False,
+        'status': status,
+        'message': message
+    }, status_code=status)
+
+
+ROUTES = [
+    Route('/actors', get_actors, methods=['GET']),
+    Route('/actors', create_actor, methods=['POST']),
+    Route('/actors/bulk', create_actors, methods=['POST']),
+    Route('/actors/{actor_id:int}', get_actor, methods=['GET']),
+    Route('/actors/{actor_id:int}', update_actor, methods=['PATCH']),
+    Route('/actors/{actor_id:int}', delete_actor, methods=['DELETE']),
+    Route('/movies', get_movies, methods=['GET']),
+    Route('/movies', create_movie, methods=['POST']),
+    Route('/movies/bulk', create_movies, methods=['POST']),
+    Route('/movies/{movie_id:int}', get_movie, methods=['GET']),
+    Route('/movies/{movie_id:int}', update_movie, methods=['PATCH']),
+    Route('/movies/{movie_id:int}', delete_movie, methods=['DELETE']),
+    Route('/movies/{movie_id:int}/actors', add_actor_to_movie, methods=['POST']),
+    Route('/movies/{movie_id:int}/actors/bulk', add_actors_to_movie, methods=['POST']),
+    Route('/movies/{movie_id:int}/actors/{actor_id:int}', remove_actor_from_movie, methods=['DELETE']),
+    Route('/search', search, methods=['GET']),
+    Route('/export/actors', export_actors, methods=['GET']),
+    Route('/export/movies', export_movies, methods=['GET']),
+    Route('/export/roles', export_roles, methods=['GET']),
+    Route('/metrics', metrics, methods=['GET'])
+]
+
+# The path template of each endpoint, to label its metrics with
+ROUTE_PATHS = {route.endpoint: route.path for route in ROUTES}
+
+
+def create_app(database_uri=None):
+    """Create the ASGI app, with an async engine for `database_uri` (from the
+    DATABASE_* variables by default)
+    """
+    database_uri = database_uri or get_database_uri()
+    engine_options = get_pool_options(database_uri)
+    if engine_options:
+        engine_options['poolclass'] = InstrumentedAsyncQueuePool
+
+    engine = create_async_engine(get_async_database_uri(database_uri), **engine_options)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    metrics_enabled = getenv('METRICS_ENABLED', '').lower() == 'true'
+    middleware = [Middleware(
+        CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+    if metrics_enabled:
+        middleware.append(Middleware(RequestMetricsMiddleware))
+
+    app = Starlette(
+        routes=ROUTES,
+        middleware=middleware,
+        exception_handlers={
+            HTTPException: http_error,
+            StarletteHTTPException: http_error
+        },
+        lifespan=lifespan
+    )
+    app.state.engine = engine
+    app.state.sessionmaker = sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False)
+    app.state.unpaginated_lists = getenv(
+        'UNPAGINATED_LISTS', '').lower() == 'true'
+    app.state.bulk_max_batch_size = int(getenv('BULK_MAX_BATCH_SIZE', 1000))
+    app.state.metrics_enabled = metrics_enabled
+
+    return app
+
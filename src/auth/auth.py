@@ -1,9 +1,11 @@
-import json
 from os import getenv
-from flask import request, _request_ctx_stack, abort
+from flask import request, _request_ctx_stack, abort, g
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from auth.jwks import jwks_store
+from auth.token_cache import token_cache
+from metrics import timed_phase
 
 
 AUTH0_DOMAIN = getenv('AUTH0_DOMAIN')
@@ -16,7 +18,11 @@ def get_token_auth_header():
 
     Followed the same pattern as BasicFlaskAuth from other Udacity coursework
     """
-    auth = request.headers.get('Authorization', None)
+    return parse_authorization_header(request.headers.get('Authorization', None))
+
+
+def parse_authorization_header(auth):
+    """Returns the bearer token in the value of an Authorization header"""
     if not auth:
         abort(401, description='Authorization header is expected.')
 
@@ -34,47 +40,68 @@ def get_token_auth_header():
     return token
 
 
-def check_permissions(permission, payload):
-    """Check for presence of permission in payload
+def compile_permissions(permission):
+    """Normalise a permission, or an iterable of permissions, into a frozenset
     """
     if not permission:
-        return True
+        return frozenset()
+
+    if isinstance(permission, str):
+        return frozenset([permission])
+
+    return frozenset(permission)
+
 
+def get_permission_set(payload):
+    """Returns the permissions granted by a token payload as a frozenset,
+    or None if the payload does not list any permissions
+    """
     if 'permissions' not in payload:
+        return None
+
+    return frozenset(payload['permissions'])
+
+
+def check_permissions(permission, permissions, any_of=frozenset()):
+    """Check that the required permissions are present in the granted permissions
+
+    permission -- permission, or set of permissions, that must all be granted
+    permissions -- frozenset of permissions granted by the token
+    any_of -- set of permissions of which at least one must be granted (optional)
+    """
+    permission = compile_permissions(permission)
+    any_of = compile_permissions(any_of)
+    if not permission and not any_of:
+        return True
+
+    if permissions is None:
         abort(400, description='Permissions expected in payload.')
 
-    if permission not in payload['permissions']:
+    if not permission <= permissions:
+        abort(403, description='Permission is not included in list of permissions.')
+
+    if any_of and permissions.isdisjoint(any_of):
         abort(403, description='Permission is not included in list of permissions.')
 
     return True
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         abort(401, description='Authorization malformed.')
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer=f"https://{AUTH0_DOMAIN}/"
-            )
+            with timed_phase('jwt_decode'):
+                payload = jwt.decode(
+                    token,
+                    rsa_key,
+                    algorithms=ALGORITHMS,
+                    audience=API_AUDIENCE,
+                    issuer=f"https://{AUTH0_DOMAIN}/"
+                )
 
             return payload
 
@@ -91,13 +118,43 @@ def verify_decode_jwt(token):
     abort(400, description='Unable to find the appropriate key.')
 
 
-def requires_auth(permission=''):
+def verify_token(token):
+    """Verify a token, and cache its payload and permission set until it expires"""
+    payload = verify_decode_jwt(token)
+    verified = (payload, get_permission_set(payload))
+    token_cache.set(token, verified, exp=payload.get('exp'))
+
+    return verified
+
+
+def get_verified_token(token):
+    """Returns the payload and permission set of a verified token, skipping
+    verification for tokens that have already been verified and have not yet expired
+    """
+    verified = token_cache.get(token)
+    if verified is None:
+        verified = verify_token(token)
+
+    return verified
+
+
+def requires_auth(permission='', any_of=None):
+    """Require a valid bearer token for the decorated endpoint
+
+    permission -- permission, or list of permissions, that must all be granted (optional)
+    any_of -- list of permissions, at least one of which must be granted (optional)
+    """
+    required = compile_permissions(permission)
+    alternatives = compile_permissions(any_of)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with timed_phase('auth'):
+                token = get_token_auth_header()
+                payload, permissions = get_verified_token(token)
+                check_permissions(required, permissions, alternatives)
+            g.permissions = permissions
             return f(*args, **kwargs)
 
         return wrapper
@@ -0,0 +1,176 @@
+import json
+import re
+import threading
+import time
+from os import getenv
+from urllib.request import urlopen
+
+from metrics import timed_phase
+
+
+JWKS_CACHE_TTL = int(getenv('JWKS_CACHE_TTL', 600))
+JWKS_MIN_REFETCH_INTERVAL = int(getenv('JWKS_MIN_REFETCH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = int(getenv('JWKS_FETCH_TIMEOUT', 5))
+
+MAX_AGE_PATTERN = re.compile(r'max-age\s*=\s*(\d+)')
+
+
+def get_jwks_url():
+    """Returns the URL that signing keys are served from
+
+    Defaults to the Auth0 tenant's well-known endpoint, but can be pointed at
+    any URL `urlopen` understands (e.g. a `file://` path) with AUTH0_JWKS_URL.
+    """
+    if getenv('AUTH0_JWKS_URL'):
+        return getenv('AUTH0_JWKS_URL')
+
+    return f"https://{getenv('AUTH0_DOMAIN')}/.well-known/jwks.json"
+
+
+def parse_max_age(cache_control):
+    """Extract the max-age in seconds from a Cache-Control header, if present"""
+    if not cache_control or 'no-cache' in cache_control or 'no-store' in cache_control:
+        return None
+
+    match = MAX_AGE_PATTERN.search(cache_control)
+    if not match:
+        return None
+
+    return int(match.group(1))
+
+
+class JWKSKeyStore:
+    """Process-wide cache of the JSON web keys used to verify tokens
+
+    Keys are fetched once and indexed by `kid`. Once the TTL (taken from the
+    Cache-Control header when the server sends one) runs out, the stale keys
+    keep being served while a background thread refreshes them. An unknown
+    `kid` triggers an on-demand refetch, at most once per `min_refetch_interval`
+    seconds so that junk tokens cannot be used to hammer the identity provider.
+    """
+
+    def __init__(self, url=None, ttl=JWKS_CACHE_TTL,
+                 min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+
+        self._keys = {}
+        self._expires_at = 0
+        self._last_fetch = None
+        self._loaded = False
+        # Guards the cached keys and expiry, never held while fetching
+        self._lock = threading.Lock()
+        # Held by the thread making the first fetch, which the others wait for
+        self._first_fetch_lock = threading.Lock()
+        # Held while a background refresh is in flight
+        self._refresh_lock = threading.Lock()
+
+    def get_key(self, kid):
+        """Returns the RSA key matching `kid`, or None if it is not known"""
+        if not self._loaded:
+            self._first_fetch()
+        elif time.monotonic() >= self._expires_at:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None:
+            fetched_at = self._claim_refetch(kid)
+            if fetched_at is not None:
+                self._fetch(fetched_at)
+            key = self._keys.get(kid)
+
+        return key
+
+    def refresh(self):
+        """Fetch the key set and swap it in, keeping the old keys on failure
+
+        The fetch runs without holding the lock, so lookups keep being served
+        the current keys while it is in flight.
+        """
+        with self._lock:
+            self._last_fetch = fetched_at = time.monotonic()
+
+        return self._fetch(fetched_at)
+
+    def _fetch(self, fetched_at):
+        try:
+            with timed_phase('jwks_fetch'):
+                response = urlopen(self.url or get_jwks_url(),
+                                   timeout=self.timeout)
+                jwks = json.loads(response.read())
+            max_age = parse_max_age(response.headers.get('Cache-Control'))
+        except Exception:
+            with self._lock:
+                self._expires_at = fetched_at + self.min_refetch_interval
+            return False
+
+        keys = {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+            for key in jwks.get('keys', []) if 'kid' in key
+        }
+        ttl = self.ttl if max_age is None else max_age
+        with self._lock:
+            self._keys = keys
+            self._expires_at = fetched_at + ttl
+        return True
+
+    def clear(self):
+        """Forget all cached keys, forcing a fetch on the next lookup"""
+        with self._lock:
+            self._keys = {}
+            self._expires_at = 0
+            self._last_fetch = None
+            self._loaded = False
+
+    def _first_fetch(self):
+        """Fetch the keys before their first use
+
+        There are no keys to serve until the fetch completes, so concurrent
+        lookups wait for the one fetch rather than each making their own.
+        """
+        with self._first_fetch_lock:
+            if not self._loaded:
+                self.refresh()
+                self._loaded = True
+
+    def _claim_refetch(self, kid):
+        """Claim the on-demand refetch for the unknown `kid`
+
+        The rate limit is checked and the fetch recorded in one step under the
+        lock, so that of concurrent lookups of unknown kids only one fetches.
+        Returns the time of the fetch, or None if no fetch should be made,
+        including when a fetch since the lookup has added `kid`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if kid in self._keys or now - self._last_fetch < self.min_refetch_interval:
+                return None
+
+            self._last_fetch = now
+            return now
+
+    def _refresh_in_background(self):
+        # Lookups made while a refresh is in flight return at once, and keep
+        # being served the stale keys
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._refresh_lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+jwks_store = JWKSKeyStore()
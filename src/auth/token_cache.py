@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+
+
+TOKEN_CACHE_SIZE = int(getenv('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_MAX_TTL = int(getenv('TOKEN_CACHE_MAX_TTL', 3600))
+
+
+def hash_token(token):
+    """Returns the key a token is cached under, so raw tokens are never stored"""
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+
+    return hashlib.sha256(token).hexdigest()
+
+
+class TokenCache:
+    """Bounded LRU cache of verified tokens
+
+    Entries are keyed by a hash of the raw token and expire at the token's
+    `exp` claim, or after `max_ttl` seconds if that comes first. Once
+    `maxsize` entries are held the least recently used one is evicted, so
+    token churn cannot grow the cache without limit.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        """Returns the value cached for `token`, or None on a miss"""
+        key = hash_token(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, token, value, exp=None):
+        """Cache the verified value for a token until `exp` (a unix timestamp)"""
+        if self.maxsize <= 0:
+            return
+
+        expires_at = time.time() + self.max_ttl
+        if exp:
+            expires_at = min(expires_at, exp)
+
+        key = hash_token(token)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+
+token_cache = TokenCache()
@@ -0,0 +1,49 @@
+"""Micro-benchmark for the actor age calculation used by Actor.format
+
+Compares the original path, which parsed a date string and read the clock
+for every actor, against the current path over date objects.
+
+Run from the `src` directory with: python -m benchmarks.age [rows]
+"""
+import random
+import sys
+import timeit
+from datetime import date, datetime, timedelta
+
+from helpers.dates import years_since_date
+
+
+def legacy_years_since_date(start_date):
+    """years_since_date as it was when date_of_birth was a string column
+
+    It counted years of 365.25 days, so it can differ from the current calendar
+    year age by one in the days around a birthday.
+    """
+    if not start_date:
+        return None
+
+    now = datetime.utcnow()
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+
+    return int((now - start).days / 365.25)
+
+
+def main(rows=100000):
+    random.seed(0)
+    dates = [date(1930, 1, 1) + timedelta(days=random.randrange(30000))
+             for _ in range(rows)]
+    strings = [d.isoformat() for d in dates]
+
+    legacy = min(timeit.repeat(
+        lambda: [legacy_years_since_date(s) for s in strings], number=1, repeat=3))
+    current = min(timeit.repeat(
+        lambda: [years_since_date(d) for d in dates], number=1, repeat=3))
+
+    print(f'rows: {rows}')
+    print(f'strptime + utcnow per row: {legacy * 1000:.1f} ms')
+    print(f'date objects, cached day:  {current * 1000:.1f} ms')
+    print(f'speedup: {legacy / current:.1f}x')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,45 @@
+"""Micro-benchmark for parsing YYYY-MM-DD strings in helpers.dates
+
+Compares the original strptime based parser against the memoized
+fromisoformat parser, for a column of unique dates and a column where a few
+dates repeat (as in a bulk load of a casting call).
+
+Run from the `src` directory with: python -m benchmarks.dates [rows]
+"""
+import random
+import sys
+import timeit
+from datetime import date, datetime, timedelta
+
+from helpers.dates import convert_dates_to_dateobjs, parse_iso_date
+
+
+def legacy_convert_date_to_dateobj(date_input):
+    """convert_date_to_dateobj as it was before the fromisoformat parser"""
+    try:
+        return datetime.strptime(date_input, '%Y-%m-%d').date()
+    except:
+        return None
+
+
+def main(rows=100000):
+    random.seed(0)
+    unique = [(date(1930, 1, 1) + timedelta(days=random.randrange(30000))).isoformat()
+              for _ in range(rows)]
+    repeated = [random.choice(unique[:200]) for _ in range(rows)]
+
+    print(f'rows: {rows}')
+    for name, column in [('unique', unique), ('repeated', repeated)]:
+        parse_iso_date.cache_clear()
+        legacy = min(timeit.repeat(
+            lambda: [legacy_convert_date_to_dateobj(d) for d in column], number=1, repeat=3))
+        current = min(timeit.repeat(
+            lambda: convert_dates_to_dateobjs(column), number=1, repeat=3))
+
+        print(f'{name} strptime:       {legacy * 1000:.1f} ms')
+        print(f'{name} fromisoformat:  {current * 1000:.1f} ms')
+        print(f'{name} speedup: {legacy / current:.1f}x')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,102 @@
+"""Load test for a running instance of the app
+
+Keeps `concurrency` clients sending requests to one endpoint for `duration`
+seconds, each over its own keep-alive connection, and reports the requests
+per second and latency percentiles. Compare gunicorn worker classes by
+starting the app with each in turn, e.g.
+
+    GUNICORN_WORKER_CLASS=sync gunicorn -c gunicorn.conf.py 'app:create_app()'
+    GUNICORN_WORKER_CLASS=gthread gunicorn -c gunicorn.conf.py 'app:create_app()'
+
+Run from the `src` directory with:
+python -m benchmarks.load http://localhost:8000/actors --concurrency 200 --duration 30 --token $TOKEN
+"""
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_client(url, headers, duration, latencies, errors, start_barrier):
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection = None
+    start_barrier.wait()
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        if connection is None:
+            connection = http.client.HTTPConnection(parts.netloc, timeout=60)
+
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(None)
+            connection.close()
+            connection = None
+            continue
+
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(response.status)
+        if response.will_close:
+            connection.close()
+            connection = None
+
+    if connection is not None:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--token', help='Bearer token sent with every request')
+    args = parser.parse_args()
+
+    headers = {'Authorization': f'Bearer {args.token}'} if args.token else {}
+    latencies = []
+    errors = []
+    start_barrier = threading.Barrier(args.concurrency + 1)
+    clients = [
+        threading.Thread(
+            target=run_client,
+            args=(args.url, headers, args.duration, latencies, errors, start_barrier),
+            daemon=True
+        )
+        for _ in range(args.concurrency)
+    ]
+
+    # Every client connects at the same time, once they have all started
+    for client in clients:
+        client.start()
+    start_barrier.wait()
+    start = time.monotonic()
+    for client in clients:
+        client.join()
+    elapsed = time.monotonic() - start
+
+    latencies.sort()
+    print(f'url: {args.url}')
+    print(f'concurrency: {args.concurrency}, duration: {elapsed:.1f} s')
+    print(f'requests: {len(latencies)}, errors: {len(errors)}')
+    print(f'requests/sec: {len(latencies) / elapsed:.1f}')
+    print(f'latency p50: {percentile(latencies, 0.5) * 1000:.1f} ms, '
+          f'p95: {percentile(latencies, 0.95) * 1000:.1f} ms, '
+          f'p99: {percentile(latencies, 0.99) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
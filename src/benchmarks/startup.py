@@ -0,0 +1,61 @@
+"""Cold start time of the app
+
+Imports the app and builds it with `create_app()` in a fresh interpreter, as
+each new dyno or gunicorn worker does, and reports the median time of `runs`
+starts. Exits with an error when the median is over `budget` seconds, so a
+slow import added to the startup path is noticed.
+
+Run from the `src` directory with:
+python -m benchmarks.startup --runs 5 --budget 1.0
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = '''
+import sys
+import time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - start, 'flask_migrate' in sys.modules)
+'''
+
+
+def measure_startup():
+    """Start the app in a new interpreter, and return the seconds it took and
+    whether Flask-Migrate was imported
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT],
+        cwd=SRC_DIR, check=True, capture_output=True, text=True
+    ).stdout.split()
+
+    return float(output[0]), output[1] == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='Maximum median seconds to start the app')
+    args = parser.parse_args()
+
+    # The first start warms the filesystem cache, like a dyno that has booted
+    measure_startup()
+    timings = [measure_startup()[0] for _ in range(args.runs)]
+    median = statistics.median(timings)
+
+    print(f'startup median: {median * 1000:.0f} ms, '
+          f'min: {min(timings) * 1000:.0f} ms, max: {max(timings) * 1000:.0f} ms')
+    if median > args.budget:
+        sys.exit(f'startup is over the budget of {args.budget * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
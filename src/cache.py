@@ -0,0 +1,262 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from os import getenv
+
+from flask import Response, g, make_response, request
+
+from models import get_table_versions
+from helpers.dates import utc_today
+from resources import stream_requested
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+RESPONSE_CACHE = getenv('RESPONSE_CACHE', 'none').lower()
+RESPONSE_CACHE_REDIS_URL = getenv(
+    'RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+RESPONSE_CACHE_SIZE = int(getenv('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = int(getenv('RESPONSE_CACHE_TTL', 300))
+
+
+class MemoryCacheBackend:
+    """In-process LRU store for cached responses
+
+    Generation counters are kept apart from the responses so that they are
+    never evicted. Only suitable when a single process serves the API, as other
+    processes do not see its invalidations.
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_generations(self, namespaces):
+        return [self._generations.get(ns, 0) for ns in namespaces]
+
+    def incr_generations(self, namespaces):
+        with self._lock:
+            for ns in namespaces:
+                self._generations[ns] = self._generations.get(ns, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+class RedisCacheBackend:
+    """Cached responses stored in Redis (or a Redis compatible server)
+
+    Shared by every worker process, so an invalidation in one is seen by all.
+    """
+
+    def __init__(self, url=RESPONSE_CACHE_REDIS_URL, prefix='casting:'):
+        if redis is None:
+            raise RuntimeError(
+                'The `redis` package must be installed to use RESPONSE_CACHE=redis')
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def get_generations(self, namespaces):
+        values = self.client.mget(
+            [f'{self.prefix}generation:{ns}' for ns in namespaces])
+        return [int(value or 0) for value in values]
+
+    def incr_generations(self, namespaces):
+        pipeline = self.client.pipeline()
+        for ns in namespaces:
+            pipeline.incr(f'{self.prefix}generation:{ns}')
+        pipeline.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_backend(name=RESPONSE_CACHE):
+    """Returns the backend for the RESPONSE_CACHE setting, or None to disable caching"""
+    if name == 'memory':
+        return MemoryCacheBackend()
+
+    if name == 'redis':
+        return RedisCacheBackend()
+
+    return None
+
+
+class ResponseCache:
+    """Read-through cache for GET endpoints
+
+    Each cached endpoint names the tables (namespaces) its response is built
+    from, and each write endpoint names the tables it changes. A write bumps
+    the generation counter of its namespaces, and the current generations are
+    part of every cache key, so entries built from old data are never read again.
+    """
+
+    def __init__(self, backend=None, ttl=RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, path, args, scope, namespaces):
+        """Returns the cache key of a request for `path`, with the sorted query
+        `args`, by a client with the `scope` permissions
+
+        The current date is part of the key, as ages in the responses change daily.
+        """
+        generations = self.backend.get_generations(namespaces)
+        raw = repr((
+            path, args, scope, list(zip(namespaces, generations)), utc_today().isoformat()))
+
+        return 'response:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the mimetype and body of the response cached under `key`, or None"""
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        mimetype, body = value.split(b'\n', 1)
+        return mimetype.decode('ascii'), body
+
+    def set(self, key, mimetype, body):
+        self.backend.set(key, mimetype.encode('ascii') + b'\n' + body, self.ttl)
+
+    def cached(self, *namespaces):
+        """Serve the decorated GET endpoint from the cache when possible"""
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or stream_requested(request.args):
+                    return f(*args, **kwargs)
+
+                key = self.get_key(
+                    request.path,
+                    sorted(request.args.items(multi=True)),
+                    sorted(getattr(g, 'permissions', None) or ()),
+                    namespaces
+                )
+                entry = self.get(key)
+                if entry is not None:
+                    mimetype, body = entry
+                    response = Response(body, mimetype=mimetype)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    self.set(key, response.mimetype, response.get_data())
+                response.headers['X-Cache'] = 'MISS'
+                return response
+
+            return wrapper
+        return cached_decorator
+
+    def invalidates(self, *namespaces):
+        """Invalidate cached responses built from `namespaces` once the decorated write succeeds"""
+        def invalidates_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                response = f(*args, **kwargs)
+                self.invalidate(*namespaces)
+                return response
+
+            return wrapper
+        return invalidates_decorator
+
+    def invalidate(self, *namespaces):
+        if self.backend is not None:
+            self.backend.incr_generations(namespaces)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+response_cache = ResponseCache(create_backend())
+
+
+def make_etag(path, args, versions):
+    """Returns the ETag of a response for `path`, with the sorted query `args`,
+    built from tables at `versions`
+    """
+    raw = repr((path, args, versions, utc_today().isoformat()))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def conditional(*tables):
+    """Add an ETag to the decorated GET endpoint, and answer If-None-Match with 304
+
+    The ETag is derived from the version counters of `tables`, the query string
+    and the current date (ages in the response change daily), so a matching
+    request is answered with a single lookup, without running the endpoint.
+    """
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if stream_requested(request.args):
+                return f(*args, **kwargs)
+
+            etag = make_etag(
+                request.path,
+                sorted(request.args.items(multi=True)),
+                get_table_versions(tables)
+            )
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+
+        return wrapper
+    return conditional_decorator
@@ -0,0 +1,91 @@
+"""gunicorn settings for serving the app
+
+Run from the `src` directory with: gunicorn -c gunicorn.conf.py 'app:create_app()'
+
+GUNICORN_WORKER_CLASS picks how each worker process serves requests:
+sync -- one request at a time, so a request waiting on Postgres (or the JWKS
+        fetch) holds up the whole worker
+gthread (default) -- a pool of GUNICORN_THREADS threads per worker
+gevent or eventlet -- up to GUNICORN_WORKER_CONNECTIONS requests per worker, on
+        greenlets. Needs the `gevent` (or `eventlet`) and `psycogreen` packages
+        installed, so that waiting on Postgres yields to other requests.
+
+Flask-SQLAlchemy scopes the database session to the current thread (or
+greenlet), and removes it when the request ends, so requests never share a
+session in any of these modes.
+
+GUNICORN_PRELOAD (default: true for sync and gthread workers) creates the app
+once in the master process, before the workers are forked, so the workers
+start faster and share the memory of the loaded code. Each worker then drops
+the database connections it inherited, so no two processes use one socket.
+gevent and eventlet workers patch the standard library when they start, after
+a preloaded app has already imported it, so they do not preload by default.
+"""
+import gc
+import multiprocessing
+from os import environ, getenv
+
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+worker_class = getenv('GUNICORN_WORKER_CLASS', 'gthread').lower()
+
+# Threads and greenlets give each process its concurrency, so only one process
+# per CPU is needed. Sync workers need more processes to overlap waiting on I/O.
+# WEB_CONCURRENCY is set by Heroku to suit the dyno size.
+if worker_class == 'sync':
+    workers = int(getenv('WEB_CONCURRENCY', CPU_COUNT * 2 + 1))
+else:
+    workers = int(getenv('WEB_CONCURRENCY', CPU_COUNT))
+
+threads = int(getenv('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+bind = f"0.0.0.0:{getenv('PORT', 8000)}"
+timeout = int(getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(getenv('GUNICORN_KEEPALIVE', 5))
+
+# Create the app in the master process, and fork the workers from it
+preload_app = getenv(
+    'GUNICORN_PRELOAD', str(worker_class in ('sync', 'gthread'))).lower() == 'true'
+
+# Give every thread its own connection, so that threads never wait on each
+# other for one. Set DATABASE_POOL_SIZE to override this. Greenlets share the
+# default pool, and wait for a free connection when all are in use.
+if worker_class == 'gthread':
+    environ.setdefault('DATABASE_POOL_SIZE', str(threads))
+
+
+def pre_fork(server, worker):
+    """Stop the garbage collector touching the objects created so far
+
+    Collections write to every object they examine, which would copy the
+    preloaded app's memory pages into each worker. Frozen objects are never
+    examined, so the pages stay shared.
+    """
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from models import dispose_engine
+        dispose_engine()
+
+    if worker_class in ('gevent', 'eventlet'):
+        patch_database_driver(server)
+
+
+def patch_database_driver(server):
+    """Make psycopg2 yield to other greenlets while it waits on Postgres"""
+    try:
+        if worker_class == 'gevent':
+            from psycogreen.gevent import patch_psycopg
+        else:
+            from psycogreen.eventlet import patch_psycopg
+    except ImportError:
+        server.log.warning(
+            'psycogreen is not installed, so database queries block every request in the worker')
+        return
+
+    patch_psycopg()
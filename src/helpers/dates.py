@@ -1,19 +1,107 @@
-from datetime import datetime, timedelta
+import time
+from datetime import MAXYEAR, MINYEAR, date, datetime
+from functools import lru_cache
+from os import getenv
 
 
-def years_since_date(start_date):
+SECONDS_PER_DAY = 86400
+DATE_CACHE_SIZE = int(getenv('DATE_CACHE_SIZE', 4096))
+
+_today = None
+_today_expires_at = 0
+
+
+def utc_today():
+    """Returns the current UTC date
+
+    The date is only recomputed when the UTC day rolls over, so serializing a
+    page of actors does not call into the clock and calendar for every row.
+    """
+    global _today, _today_expires_at
+
+    now = time.time()
+    if now >= _today_expires_at:
+        _today = datetime.utcfromtimestamp(now).date()
+        _today_expires_at = (now // SECONDS_PER_DAY + 1) * SECONDS_PER_DAY
+
+    return _today
+
+
+def years_since_date(start_date, today=None):
+    """Returns the whole calendar years between `start_date` and today, e.g. an age
+
+    Uses the same calendar years as `date_years_ago`, so an actor's age agrees
+    with the `min_age` and `max_age` filters on their birthday.
+    """
     if not start_date:
         return None
 
-    now = datetime.utcnow()
-    start = datetime.strptime(start_date, '%Y-%m-%d')
+    if isinstance(start_date, str):
+        start_date = convert_date_to_dateobj(start_date)
+        if start_date is None:
+            return None
 
-    return int((now - start).days / 365.25)
+    today = today or utc_today()
 
+    before_anniversary = (today.month, today.day) < (start_date.month, start_date.day)
+    return today.year - start_date.year - before_anniversary
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_iso_date(date_input):
+    """Parse a date in strict YYYY-MM-DD format, returns None if it is invalid
+
+    Results are memoized, as the same dates turn up again and again in bulk loads.
+    """
+    if len(date_input) != 10 or date_input[4] != '-' or date_input[7] != '-' \
+            or not date_input.isascii():
+        return None
 
-def convert_date_to_dateobj(date_input):
-    expected_format = '%Y-%m-%d'
     try:
-        return datetime.strptime(date_input, expected_format)
-    except:
+        return date.fromisoformat(date_input)
+    except ValueError:
+        return None
+
+
+def convert_date_to_dateobj(date_input):
+    if not isinstance(date_input, str):
+        return None
+
+    return parse_iso_date(date_input)
+
+
+def convert_dates_to_dateobjs(date_inputs):
+    """Convert a whole column of YYYY-MM-DD strings to dates at once
+
+    Entries that are missing or invalid are converted to None.
+    """
+    parse = parse_iso_date
+    return [
+        parse(date_input) if isinstance(date_input, str) else None
+        for date_input in date_inputs
+    ]
+
+
+def format_date(date_value):
+    """Returns a date in the YYYY-MM-DD format used by the API"""
+    if not date_value:
+        return None
+
+    return date_value.isoformat()
+
+
+def date_years_ago(years, today=None):
+    """Returns the date `years` calendar years before today
+
+    29 February maps onto 28 February in years that are not leap years.
+    Returns None if the date is outside the years a date can have.
+    """
+    today = today or utc_today()
+    year = today.year - years
+    if not MINYEAR <= year <= MAXYEAR:
         return None
+
+    try:
+        return today.replace(year=year)
+    except ValueError:
+        return today.replace(year=year, day=28)
@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from os import getenv
+
+from flask import Response, stream_with_context
+from sqlalchemy import Text, cast, func, literal_column, select
+
+
+EXPORT_CHUNK_SIZE = int(getenv('EXPORT_CHUNK_SIZE', 5000))
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# The column of an NDJSON export holding each row encoded by the database
+NDJSON_COLUMN = 'ndjson'
+
+
+def encode_value(value):
+    """JSON fallback for column types the encoder does not handle natively"""
+    if isinstance(value, date):
+        return value.isoformat()
+
+    return str(value)
+
+
+def json_object_column(table, dialect):
+    """Column encoding each row of `table` as a compact JSON object, with its keys
+    in column order, or None if the `dialect` database cannot
+    """
+    if dialect == 'postgresql':
+        # Cast, as the drivers decode json values into dicts
+        return cast(func.row_to_json(literal_column(table.name)), Text)
+
+    if dialect == 'sqlite':
+        pairs = []
+        for column in table.columns:
+            pairs.extend([literal_column(f"'{column.name}'"), column])
+        return func.json_object(*pairs)
+
+    return None
+
+
+def export_statement(table, order_by, export_format, dialect):
+    """SELECT statement reading every row of `table` for an export
+
+    For NDJSON, databases that can build JSON objects encode each row
+    themselves, so that rows reach Python as finished lines of JSON rather than
+    being turned into dicts and encoded one by one, which took most of the time
+    of an export.
+    """
+    column = json_object_column(table, dialect)
+    if export_format != 'ndjson' or column is None:
+        return table.select().order_by(*order_by)
+
+    return select(column.label(NDJSON_COLUMN)).select_from(table).order_by(*order_by)
+
+
+def fetch_chunks(result, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of rows from a result, `chunk_size` rows at a time"""
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        result.close()
+
+
+def ndjson_encoder(columns):
+    """Returns a function encoding a list of rows as newline-delimited JSON objects"""
+    encoder = json.JSONEncoder(separators=(',', ':'), default=encode_value)
+
+    def encode(rows):
+        return ''.join(
+            encoder.encode(dict(zip(columns, row))) + '\n' for row in rows
+        )
+
+    return encode
+
+
+def encode_json_lines(rows):
+    """Encode a list of rows already encoded as JSON by the database as NDJSON"""
+    return ''.join([row[0] + '\n' for row in rows])
+
+
+def encode_csv(rows):
+    """Encode a list of rows as CSV"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def export_encoder(columns, export_format):
+    """Returns the text an export of `columns` starts with, and a function
+    encoding each list of rows in `export_format`
+    """
+    if export_format == 'csv':
+        return encode_csv([columns]), encode_csv
+
+    if columns == [NDJSON_COLUMN]:
+        return '', encode_json_lines
+
+    return '', ndjson_encoder(columns)
+
+
+def export_chunks(columns, chunks, export_format):
+    """Encode chunks of rows in `export_format`"""
+    header, encode = export_encoder(columns, export_format)
+    if header:
+        yield header
+
+    for rows in chunks:
+        yield encode(rows)
+
+
+def gzip_compressor():
+    """Returns a compressor producing a gzip stream"""
+    return zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+
+def gzip_chunks(chunks):
+    """Compress a stream of text chunks into a gzip stream on the fly"""
+    compressor = gzip_compressor()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def export_headers(gzip):
+    """Returns the headers of an export response, gzip encoded if `gzip` is set"""
+    if not gzip:
+        return {}
+
+    return {'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'}
+
+
+def stream_export(result, export_format='ndjson', gzip=False):
+    """Stream the rows of a Core result back as NDJSON or CSV
+
+    Rows are read from the database cursor in chunks of EXPORT_CHUNK_SIZE and
+    never turned into ORM objects.
+    """
+    body = export_chunks(list(result.keys()), fetch_chunks(result), export_format)
+    if gzip:
+        body = gzip_chunks(body)
+
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers=export_headers(gzip)
+    )
@@ -0,0 +1,60 @@
+from sqlalchemy.orm import load_only, selectinload
+
+
+EXPAND_OPTIONS = ('none', 'ids', 'nested')
+
+
+def parse_fields(fields, allowed, default=None):
+    """Convert the `fields` query parameter into the list of fields to return
+
+    `fields` is a comma separated list of names from `allowed`. Returns the
+    fields in `default` (every field in `allowed` if not given) if no fields
+    were requested, and None if any requested field is unknown.
+    """
+    if not fields:
+        return list(allowed if default is None else default)
+
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    if not names or any(name not in allowed for name in names):
+        return None
+
+    return list(dict.fromkeys(names))
+
+
+def parse_expand(expand, default):
+    """Convert the `expand` query parameter into how relationships are returned
+
+    `none` omits them, `ids` returns the ids of the related rows, and `nested`
+    returns the related rows themselves. Returns `default` if no expansion was
+    requested, and None if the value is unknown.
+    """
+    if not expand:
+        return default
+
+    expand = expand.lower()
+    if expand not in EXPAND_OPTIONS:
+        return None
+
+    return expand
+
+
+def load_fields(query, field_columns, fields, relationships=None, expand='nested',
+                loader=selectinload, extra_columns=()):
+    """Only load the columns and relationships needed to serialize `fields`
+
+    `field_columns` maps each field to the columns it is built from, and
+    `relationships` maps each field holding related objects to the relationship
+    and, for each `expand` option, the columns of the related objects that are
+    serialized. `extra_columns` are loaded as well, such as the column a page is
+    sorted by.
+    """
+    columns = list(extra_columns)
+    for field in fields:
+        columns.extend(field_columns.get(field, ()))
+
+    options = [load_only(*columns)]
+    for field, (relationship, related_columns) in (relationships or {}).items():
+        if field in fields:
+            options.append(loader(relationship).load_only(*related_columns[expand]))
+
+    return query.options(*options)
@@ -0,0 +1,23 @@
+from sqlalchemy import func
+
+
+LIKE_ESCAPE = '\\'
+
+
+def escape_like(value):
+    """Escape the LIKE wildcards in a user supplied value"""
+    return (
+        value.replace(LIKE_ESCAPE, LIKE_ESCAPE * 2)
+        .replace('%', LIKE_ESCAPE + '%')
+        .replace('_', LIKE_ESCAPE + '_')
+    )
+
+
+def prefix_match(column, prefix):
+    """Case-insensitive "starts with" condition
+
+    Written as `lower(column) LIKE 'prefix%'` so that it can be answered from an
+    index on `lower(column) text_pattern_ops`.
+    """
+    return func.lower(column).like(
+        escape_like(prefix.lower()) + '%', escape=LIKE_ESCAPE)
@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+
+def trigrams(text):
+    """Returns the set of lower-cased trigrams in `text`
+
+    Each word is padded the same way as PostgreSQL's pg_trgm, with two spaces
+    before and one after, so short prefixes still produce trigrams.
+    """
+    grams = set()
+    for word in text.lower().split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    return grams
+
+
+class NGramIndex:
+    """In-memory trigram index over short strings, such as names and titles
+
+    Used for search when the database does not support trigram indexes. Scores
+    follow pg_trgm's word_similarity: the share of the query's trigrams found
+    in the indexed text, so partial names still rank highly.
+    """
+
+    def __init__(self, threshold=0.3):
+        self.threshold = threshold
+        self._texts = {}
+        self._postings = defaultdict(set)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add(self, key, text):
+        self.remove(key)
+        if not text:
+            return
+
+        self._texts[key] = text
+        for gram in trigrams(text):
+            self._postings[gram].add(key)
+
+    def remove(self, key):
+        text = self._texts.pop(key, None)
+        if text is None:
+            return
+
+        for gram in trigrams(text):
+            self._postings[gram].discard(key)
+            if not self._postings[gram]:
+                del self._postings[gram]
+
+    def search(self, query, limit, offset=0):
+        """Returns (key, text, score) for the best matches, best first
+
+        Ties are broken by key, so that pages are stable.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        counts = defaultdict(int)
+        for gram in query_grams:
+            for key in self._postings.get(gram, ()):
+                counts[key] += 1
+
+        needle = query.lower()
+        matches = []
+        for key, count in counts.items():
+            score = count / len(query_grams)
+            if score >= self.threshold or needle in self._texts[key].lower():
+                matches.append((key, self._texts[key], score))
+
+        matches.sort(key=lambda match: (-match[2], match[0]))
+        return matches[offset:offset + limit]
@@ -0,0 +1,183 @@
+import base64
+import binascii
+import json
+from datetime import date
+from os import getenv
+
+from sqlalchemy import Date, tuple_
+
+from helpers.dates import convert_date_to_dateobj
+
+
+PAGE_SIZE_DEFAULT = int(getenv('PAGE_SIZE_DEFAULT', 50))
+PAGE_SIZE_MAX = int(getenv('PAGE_SIZE_MAX', 500))
+
+
+def encode_cursor(values):
+    """Encode the keyset values of the last row on a page into an opaque cursor"""
+    values = [v.isoformat() if isinstance(v, date) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor produced by encode_cursor for a page keyed on `columns`
+
+    Returns the keyset values converted back to the types of `columns`, or None
+    if the cursor is invalid or was produced for a different sort order.
+    """
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        return None
+
+    decoded = []
+    for column, value in zip(columns, values):
+        if value is None:
+            if not column.nullable:
+                return None
+        elif isinstance(column.type, Date):
+            value = convert_date_to_dateobj(value)
+            if value is None:
+                return None
+        elif not isinstance(value, column.type.python_type) or isinstance(value, bool):
+            return None
+
+        decoded.append(value)
+
+    return decoded
+
+
+def parse_page_size(limit):
+    """Convert the `limit` query parameter into a page size
+
+    Missing values use PAGE_SIZE_DEFAULT, and values above PAGE_SIZE_MAX are
+    capped. Returns None if the value is not a positive integer.
+    """
+    if limit is None or limit == '':
+        return PAGE_SIZE_DEFAULT
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        return None
+
+    if limit < 1:
+        return None
+
+    return min(limit, PAGE_SIZE_MAX)
+
+
+def parse_sort(sort, sort_columns):
+    """Convert the `sort` query parameter into a column and direction
+
+    `sort` is the name of one of `sort_columns`, optionally prefixed with `-` to
+    sort in descending order. Returns (None, False) if no sort was requested,
+    and None if the field cannot be sorted on.
+    """
+    if not sort:
+        return None, False
+
+    descending = sort.startswith('-')
+    column = sort_columns.get(sort.lstrip('-'))
+    if column is None:
+        return None
+
+    return column, descending
+
+
+def keyset_columns(key_column, sort_column=None):
+    """Returns the columns that identify a row's position in the sort order"""
+    if sort_column is None or sort_column is key_column:
+        return [key_column]
+
+    return [sort_column, key_column]
+
+
+def order_by_keyset(query, columns, descending=False):
+    """Order `query` by the keyset columns, with nulls last in either direction
+
+    NULLS LAST is only given for nullable columns, so that the order on the
+    others matches their indexes, scanned in either direction.
+    """
+    order = []
+    for column in columns:
+        column_order = column.desc() if descending else column.asc()
+        order.append(column_order.nullslast() if column.nullable else column_order)
+
+    return query.order_by(*order)
+
+
+def after_keyset(columns, values, descending=False):
+    """Build the condition selecting rows that sort after the keyset `values`
+
+    A single (row-value) comparison, so that it reads one range of the index on
+    the keyset columns. Only selects rows whose keyset columns are not null.
+    """
+    if len(columns) == 1:
+        keyset, after = columns[0], values[0]
+    else:
+        keyset, after = tuple_(*columns), tuple_(*values)
+
+    return keyset < after if descending else keyset > after
+
+
+def page_queries(query, key_column, after=None, sort_column=None, descending=False):
+    """Restrict `query` to the rows after the cursor `after`, using keyset pagination
+
+    Rows are ordered by `sort_column` (if given) and then by the unique
+    `key_column`. Returns the queries to read rows from in turn, until a page is
+    full, each reading one range of the index on the keyset columns. Rows where
+    a nullable `sort_column` is null sort last, and are read by a query of
+    their own, as no single range covers them and the rows before them.
+    """
+    columns = keyset_columns(key_column, sort_column)
+    query = order_by_keyset(query, columns, descending)
+    if len(columns) == 1 or not sort_column.nullable:
+        if after:
+            query = query.filter(after_keyset(columns, after, descending))
+        return [query]
+
+    nulls = query.filter(sort_column.is_(None))
+    if after and after[0] is None:
+        return [nulls.filter(after_keyset(columns[1:], after[1:], descending))]
+
+    values = query.filter(sort_column.isnot(None))
+    if after:
+        values = values.filter(after_keyset(columns, after, descending))
+    return [values, nulls]
+
+
+def split_page(rows, key_column, limit, sort_column=None):
+    """Returns the rows read by `page_queries` that are on the page, and the
+    cursor for the following page (None if this is the last page)
+    """
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    columns = keyset_columns(key_column, sort_column)
+    return rows, encode_cursor([getattr(rows[-1], c.key) for c in columns])
+
+
+def paginate(query, key_column, limit, after=None, sort_column=None, descending=False):
+    """Fetch one page of `query` using keyset pagination
+
+    Returns the rows on the page, and the cursor for the following page (None
+    if this is the last page).
+    """
+    # One row more than `limit` is read, to tell whether there is a following page
+    rows = []
+    for page_query in page_queries(query, key_column, after, sort_column, descending):
+        rows.extend(page_query.limit(limit + 1 - len(rows)).all())
+        if len(rows) > limit:
+            break
+
+    return split_page(rows, key_column, limit, sort_column)
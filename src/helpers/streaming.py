@@ -0,0 +1,45 @@
+import json
+from os import getenv
+
+from flask import Response, stream_with_context
+
+
+STREAM_CHUNK_SIZE = int(getenv('STREAM_CHUNK_SIZE', 500))
+ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+def json_list_head(key):
+    """Returns the start of `{"success": true, "<key>": [...]}`, up to the first item"""
+    return f'{{"success":true,"{key}":['
+
+
+def encode_json_rows(rows, serialize):
+    """Encode each of `rows` with `serialize`, as comma separated JSON list items"""
+    return ','.join(ENCODER.encode(serialize(row)) for row in rows)
+
+
+def stream_json_list(key, rows, serialize, chunk_size=STREAM_CHUNK_SIZE):
+    """Stream `{"success": true, "<key>": [...]}` as a chunked response
+
+    `rows` is iterated lazily (e.g. a query using `yield_per`), and each row is
+    encoded with `serialize` as it arrives, so neither the full list of objects
+    nor the full response body are ever held in memory.
+    """
+    def generate():
+        yield json_list_head(key)
+
+        chunk = []
+        separator = ''
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield separator + encode_json_rows(chunk, serialize)
+                chunk = []
+                separator = ','
+
+        if chunk:
+            yield separator + encode_json_rows(chunk, serialize)
+
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
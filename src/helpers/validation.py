@@ -0,0 +1,97 @@
+from helpers.dates import convert_date_to_dateobj
+
+
+# The length of the `actors.gender` column
+GENDER_MAX_LENGTH = 10
+# Names and titles are unbounded in the database, but no real one is this long
+TEXT_MAX_LENGTH = 500
+
+
+def validate_text(data, field, max_length=TEXT_MAX_LENGTH):
+    """Validate the optional text attribute `field` of a payload
+
+    Returns a description of the problem, or None if the attribute is valid.
+    """
+    value = data.get(field)
+    if value is None:
+        return None
+
+    if not isinstance(value, str):
+        return f'`{field}` must be a string'
+
+    if len(value) > max_length:
+        return f'`{field}` must be at most {max_length} characters'
+
+    return None
+
+
+def validate_actor(data):
+    """Validate the payload for a new actor
+
+    Returns a description of the problem, or None if the payload is valid.
+    """
+    if not isinstance(data, dict) or not data.get('name'):
+        return '`name` attribute must be specified'
+
+    error = validate_text(data, 'name') or validate_text(data, 'gender', GENDER_MAX_LENGTH)
+    if error:
+        return error
+
+    if data.get('date_of_birth') and convert_date_to_dateobj(data['date_of_birth']) == None:
+        return '`date_of_birth` must be in format YYYY-MM-DD'
+
+    return None
+
+
+def validate_movie(data):
+    """Validate the payload for a new movie
+
+    Returns a description of the problem, or None if the payload is valid.
+    """
+    if not isinstance(data, dict) or not data.get('title'):
+        return '`title` attribute must be provided.'
+
+    error = validate_text(data, 'title')
+    if error:
+        return error
+
+    if data.get('release_date') and convert_date_to_dateobj(data['release_date']) == None:
+        return '`release_date` must be in format YYYY-MM-DD'
+
+    return None
+
+
+def validate_actor_update(data):
+    """Validate the payload for an update to an actor
+
+    Returns a description of the problem, or None if the payload is valid.
+    """
+    if not isinstance(data, dict) or not (data.get('name') or data.get('date_of_birth') or data.get('gender')):
+        return 'At least one of `name`, `date_of_birth`, or `gender` must be provided.'
+
+    error = validate_text(data, 'name') or validate_text(data, 'gender', GENDER_MAX_LENGTH)
+    if error:
+        return error
+
+    if data.get('date_of_birth') and convert_date_to_dateobj(data['date_of_birth']) == None:
+        return '`date_of_birth` must be in format YYYY-MM-DD'
+
+    return None
+
+
+def validate_movie_update(data):
+    """Validate the payload for an update to a movie
+
+    Returns a description of the problem, or None if the payload is valid.
+    """
+    if not isinstance(data, dict) or not (data.get('title') or data.get('release_date')):
+        return 'Either `title` or `release_date` attribute must be specified'
+
+    error = validate_text(data, 'title')
+    if error:
+        return error
+
+    if data.get('release_date') and convert_date_to_dateobj(data['release_date']) == None:
+        return '`release_date` must be in format YYYY-MM-DD'
+
+    return None
@@ -0,0 +1,178 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+
+# Upper bounds (in seconds) of the latency buckets, from 1ms to 10s
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+
+    escaped = [
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Histogram:
+    """Distribution of observed values, rendered as a Prometheus histogram
+
+    Observations are counted in the bucket they fall into, and only made
+    cumulative when rendered, so `observe` is a bisect and three additions.
+    """
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS, label_names=()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram'
+        ]
+        with self._lock:
+            series = [(key, list(counts), total, count)
+                      for key, (counts, total, count) in self._series.items()]
+
+        for label_values, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                labels = format_labels(
+                    self.label_names, label_values, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+
+        return lines
+
+
+class Gauge:
+    """Value read when the metrics are rendered, such as the state of a pool
+
+    `read` returns the current value, or None if there is nothing to report.
+    """
+
+    def __init__(self, name, description, read):
+        self.name = name
+        self.description = description
+        self.read = read
+
+    def render(self):
+        value = self.read()
+        if value is None:
+            return []
+
+        return [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} gauge',
+            f'{self.name} {value}'
+        ]
+
+
+class Registry:
+    """The metrics exposed on the /metrics endpoint"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.register(Histogram(
+    'http_request_duration_seconds',
+    'Time taken to serve each request, from routing to the response being returned',
+    label_names=('method', 'route', 'status')
+))
+REQUEST_PHASE_DURATION = registry.register(Histogram(
+    'http_request_phase_duration_seconds',
+    'Time each request spent in each phase: auth (with its jwks_fetch and jwt_decode), '
+    'db, serialize and encode',
+    label_names=('route', 'phase')
+))
+
+
+# Seconds spent in each phase of the request being served by the current
+# thread (or greenlet), or None when no request is being timed
+_request_phases = ContextVar('request_phases', default=None)
+
+
+def start_request_phases():
+    """Start adding up the time the current request spends in each phase"""
+    _request_phases.set({})
+
+
+def stop_request_phases():
+    """Stop timing the current request, and return the seconds spent in each phase"""
+    phases = _request_phases.get()
+    _request_phases.set(None)
+    return phases or {}
+
+
+def add_phase_time(phase, seconds):
+    """Add `seconds` to `phase` of the current request, if it is being timed"""
+    phases = _request_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+class timed_phase:
+    """Context manager adding the time spent in its block to `phase` of the
+    current request
+
+    A class rather than a generator based context manager, as it wraps code
+    that runs on every request, and is several times cheaper to enter.
+    """
+    __slots__ = ('phase', 'start')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_phase_time(self.phase, time.perf_counter() - self.start)
@@ -0,0 +1,33 @@
+"""add table version counters for conditional requests
+
+Revision ID: 2a7f3c9b5e14
+Revises: 9e1b4d6f3c28
+Create Date: 2026-10-18 13:42:18.406217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a7f3c9b5e14'
+down_revision = '9e1b4d6f3c28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': 'actors', 'version': 0},
+        {'name': 'movies', 'version': 0},
+        {'name': 'roles', 'version': 0}
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,46 @@
+"""replace the sort column indexes with (sort column, id) indexes for keyset pagination
+
+Revision ID: 3f6a9c2d7b15
+Revises: 5d8e1a6c3b92
+Create Date: 2026-10-18 16:42:09.518377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6a9c2d7b15'
+down_revision = '5d8e1a6c3b92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Sorted pages are ordered by (sort column, id) and start with a row-value
+    # comparison on the same columns, so one range of these indexes reads a page
+    op.create_index('ix_actors_name_id', 'actors', ['name', 'id'], unique=False)
+    op.create_index('ix_actors_date_of_birth_id', 'actors', ['date_of_birth', 'id'], unique=False)
+    op.create_index('ix_movies_title_id', 'movies', ['title', 'id'], unique=False)
+    op.create_index('ix_movies_release_date_id', 'movies', ['release_date', 'id'], unique=False)
+    # Nulls sort last in both directions, which a backward scan of the indexes
+    # above does not give for the nullable dates when sorting in descending order
+    op.create_index('ix_actors_date_of_birth_id_desc', 'actors', [sa.text('date_of_birth DESC NULLS LAST'), sa.text('id DESC')], unique=False)
+    op.create_index('ix_movies_release_date_id_desc', 'movies', [sa.text('release_date DESC NULLS LAST'), sa.text('id DESC')], unique=False)
+    op.drop_index(op.f('ix_actors_name'), table_name='actors')
+    op.drop_index(op.f('ix_actors_date_of_birth'), table_name='actors')
+    op.drop_index(op.f('ix_movies_title'), table_name='movies')
+    op.drop_index(op.f('ix_movies_release_date'), table_name='movies')
+
+
+def downgrade():
+    op.create_index(op.f('ix_movies_release_date'), 'movies', ['release_date'], unique=False)
+    op.create_index(op.f('ix_movies_title'), 'movies', ['title'], unique=False)
+    op.create_index(op.f('ix_actors_date_of_birth'), 'actors', ['date_of_birth'], unique=False)
+    op.create_index(op.f('ix_actors_name'), 'actors', ['name'], unique=False)
+    op.drop_index('ix_movies_release_date_id_desc', table_name='movies')
+    op.drop_index('ix_actors_date_of_birth_id_desc', table_name='actors')
+    op.drop_index('ix_movies_release_date_id', table_name='movies')
+    op.drop_index('ix_movies_title_id', table_name='movies')
+    op.drop_index('ix_actors_date_of_birth_id', table_name='actors')
+    op.drop_index('ix_actors_name_id', table_name='actors')
@@ -0,0 +1,46 @@
+"""convert actor and movie dates to native DATE columns
+
+Revision ID: 4b2d9c7e1a3f
+Revises: fe662ed8c1d9
+Create Date: 2026-10-18 10:12:31.408211
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b2d9c7e1a3f'
+down_revision = 'fe662ed8c1d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column('actors', 'date_of_birth',
+               existing_type=sa.String(),
+               type_=sa.Date(),
+               existing_nullable=True,
+               postgresql_using="NULLIF(date_of_birth, '')::date")
+    op.alter_column('movies', 'release_date',
+               existing_type=sa.String(),
+               type_=sa.Date(),
+               existing_nullable=True,
+               postgresql_using="NULLIF(release_date, '')::date")
+    op.create_index(op.f('ix_actors_date_of_birth'), 'actors', ['date_of_birth'], unique=False)
+    op.create_index(op.f('ix_movies_release_date'), 'movies', ['release_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_movies_release_date'), table_name='movies')
+    op.drop_index(op.f('ix_actors_date_of_birth'), table_name='actors')
+    op.alter_column('movies', 'release_date',
+               existing_type=sa.Date(),
+               type_=sa.String(),
+               existing_nullable=True,
+               postgresql_using="to_char(release_date, 'YYYY-MM-DD')")
+    op.alter_column('actors', 'date_of_birth',
+               existing_type=sa.Date(),
+               type_=sa.String(),
+               existing_nullable=True,
+               postgresql_using="to_char(date_of_birth, 'YYYY-MM-DD')")
@@ -0,0 +1,26 @@
+"""add an index on roles.movie_id for counting and loading a movie's cast
+
+Revision ID: 5d8e1a6c3b92
+Revises: 2a7f3c9b5e14
+Create Date: 2026-10-18 14:20:51.633109
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8e1a6c3b92'
+down_revision = '2a7f3c9b5e14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The roles primary key starts with actor_id, so it cannot be used to find
+    # the roles in a movie
+    op.create_index(op.f('ix_roles_movie_id'), 'roles', ['movie_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_roles_movie_id'), table_name='roles')
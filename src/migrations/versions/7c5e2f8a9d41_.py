@@ -0,0 +1,34 @@
+"""add indexes for filtering and sorting actors and movies
+
+Revision ID: 7c5e2f8a9d41
+Revises: 4b2d9c7e1a3f
+Create Date: 2026-10-18 11:03:47.192630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c5e2f8a9d41'
+down_revision = '4b2d9c7e1a3f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_actors_gender'), 'actors', ['gender'], unique=False)
+    op.create_index(op.f('ix_actors_name'), 'actors', ['name'], unique=False)
+    op.create_index(op.f('ix_movies_title'), 'movies', ['title'], unique=False)
+    # Prefix filters are written as lower(column) LIKE 'prefix%', which can only
+    # use an index built with text_pattern_ops on the same expression
+    op.create_index('ix_actors_name_prefix', 'actors', [sa.text('lower(name) text_pattern_ops')], unique=False)
+    op.create_index('ix_movies_title_prefix', 'movies', [sa.text('lower(title) text_pattern_ops')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_movies_title_prefix', table_name='movies')
+    op.drop_index('ix_actors_name_prefix', table_name='actors')
+    op.drop_index(op.f('ix_movies_title'), table_name='movies')
+    op.drop_index(op.f('ix_actors_name'), table_name='actors')
+    op.drop_index(op.f('ix_actors_gender'), table_name='actors')
@@ -0,0 +1,27 @@
+"""add trigram indexes for searching actor names and movie titles
+
+Revision ID: 9e1b4d6f3c28
+Revises: 7c5e2f8a9d41
+Create Date: 2026-10-18 12:26:05.730914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e1b4d6f3c28'
+down_revision = '7c5e2f8a9d41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_actors_name_trgm', 'actors', [sa.text('name gin_trgm_ops')], unique=False, postgresql_using='gin')
+    op.create_index('ix_movies_title_trgm', 'movies', [sa.text('title gin_trgm_ops')], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
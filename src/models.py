@@ -1,6 +1,18 @@
 
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from flask_sqlalchemy import SQLAlchemy
-from helpers.dates import years_since_date
+from sqlalchemy import DDL, event, exc, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import column_property, configure_mappers
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+from helpers.dates import format_date, years_since_date
+from helpers.validation import GENDER_MAX_LENGTH
+from metrics import Gauge, Histogram, add_phase_time, registry
 
 from os import getenv
 from dotenv import load_dotenv
@@ -10,31 +22,350 @@ load_dotenv()
 db = SQLAlchemy()
 
 
+# Engine options read from each environment variable, when it is set
+POOL_SETTINGS = {
+    'pool_size': 'DATABASE_POOL_SIZE',
+    'max_overflow': 'DATABASE_MAX_OVERFLOW',
+    'pool_timeout': 'DATABASE_POOL_TIMEOUT',
+    'pool_recycle': 'DATABASE_POOL_RECYCLE'
+}
+
+POOL_WAIT_SECONDS = registry.register(Histogram(
+    'db_pool_wait_seconds',
+    'Time spent waiting to check a connection out of the pool, '
+    'not counting the time to open new connections'
+))
+
+
+class InstrumentedPool:
+    """Mixin for a pool class, recording how long each checkout waits for a connection
+
+    The time spent opening a new connection during the checkout, recorded by
+    `start_connect_timer` and `record_connect_time`, is taken out, so that only
+    the time spent queueing for a connection is recorded.
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        connection = super().connect()
+        connect_seconds = connection.info.pop('connect_seconds', 0.0)
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - start - connect_seconds)
+        return connection
+
+
+class InstrumentedQueuePool(InstrumentedPool, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+# The engine whose pool is reported on /metrics, when it is not the Flask app's,
+# set by the ASGI app while it renders the metrics
+metrics_engine = ContextVar('metrics_engine', default=None)
+
+
+def get_pool_status(status):
+    """Read `status` (e.g. `checkedout`) from the pool, if the pool keeps it"""
+    def read():
+        engine = metrics_engine.get() or db.engine
+        read_status = getattr(engine.pool, status, None)
+        return read_status() if read_status else None
+
+    return read
+
+
+registry.register(Gauge(
+    'db_pool_size', 'Connections the pool keeps open', get_pool_status('size')))
+registry.register(Gauge(
+    'db_pool_checked_out', 'Connections currently in use', get_pool_status('checkedout')))
+registry.register(Gauge(
+    'db_pool_checked_in', 'Idle connections in the pool', get_pool_status('checkedin')))
+registry.register(Gauge(
+    'db_pool_overflow', 'Connections open beyond the pool size (negative while below it)',
+    get_pool_status('overflow')))
+
+
+def get_pool_options(database_uri):
+    """Connection pool options for the engine, from the DATABASE_POOL_* environment variables
+
+    SQLite databases keep SQLAlchemy's default pool, which takes none of these options.
+    """
+    if database_uri.startswith('sqlite'):
+        return {}
+
+    options = {
+        'pool_pre_ping': getenv('DATABASE_POOL_PRE_PING', '').lower() == 'true'
+    }
+    for option, variable in POOL_SETTINGS.items():
+        if getenv(variable):
+            options[option] = int(getenv(variable))
+
+    return options
+
+
+def get_database_uri(db_name=None):
+    """Returns DATABASE_URL, or the URI of the database described by the DATABASE_* variables"""
+    if getenv('DATABASE_URL'):
+        # Heroku sets a `postgres://` URL, which SQLAlchemy 1.4 no longer accepts
+        return getenv('DATABASE_URL').replace('postgres://', 'postgresql://', 1)
+
+    db_user = getenv('DATABASE_USER')
+    db_pwd = getenv('DATABASE_PWD')
+    db_host = getenv('DATABASE_HOST')
+    db_port = getenv('DATABASE_PORT')
+    if not db_name:
+        db_name = getenv('DATABASE_USER')
+
+    return f"postgresql://{db_user}:{db_pwd}@{db_host}:{db_port}/{db_name}"
+
+
 def setup_db(app, db_name=None):
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if not app.config.get("SQLALCHEMY_DATABASE_URI"):
+        app.config["SQLALCHEMY_DATABASE_URI"] = get_database_uri(db_name)
 
-    if getenv('DATABASE_URL'):
-        app.config["SQLALCHEMY_DATABASE_URI"] = getenv('DATABASE_URL')
-    else:
-        db_user = getenv('DATABASE_USER')
-        db_pwd = getenv('DATABASE_PWD')
-        db_host = getenv('DATABASE_HOST')
-        db_port = getenv('DATABASE_PORT')
-        if not db_name:
-            db_name = getenv('DATABASE_USER')
-
-        app.config["SQLALCHEMY_DATABASE_URI"] = f"postgresql://{db_user}:{db_pwd}@{db_host}:{db_port}/{db_name}"
+    engine_options = get_pool_options(app.config["SQLALCHEMY_DATABASE_URI"])
+    if engine_options:
+        engine_options['poolclass'] = InstrumentedQueuePool
+
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
     db.app = app
     db.init_app(app)
 
+    # Resolve the relationships between the models now, rather than on the
+    # first query, so that with gunicorn's preload_app the work is done once,
+    # before the workers are forked, and its memory is shared between them
+    configure_mappers()
+
+
+def dispose_engine():
+    """Drop the pooled connections this process inherited from its parent
+
+    Call in every process forked after the engine was used, e.g. from gunicorn's
+    post_fork hook when the app is preloaded, so that workers never share a
+    socket with the parent or each other. The connections are not closed, as
+    the parent still owns them. The engine opens new connections when needed.
+    """
+    db.engine.dispose(close=False)
+
+
+@event.listens_for(Engine, 'do_connect')
+def start_connect_timer(dialect, connection_record, cargs, cparams):
+    connection_record.info['connect_start'] = time.perf_counter()
+
+
+@event.listens_for(Pool, 'connect')
+def record_connect_time(dbapi_connection, connection_record):
+    """Record how long the new connection took to open, for `InstrumentedPool`"""
+    start = connection_record.info.pop('connect_start', None)
+    if start is not None:
+        connection_record.info['connect_seconds'] = time.perf_counter() - start
+
+
+@event.listens_for(Pool, 'connect')
+def record_connection_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def check_connection_pid(dbapi_connection, connection_record, connection_proxy):
+    """Refuse a pooled connection opened by another process
+
+    A safety net for forks that did not call `dispose_engine`: the pool
+    discards the connection, without closing the other process's socket, and
+    checks out a new one.
+    """
+    pid = os.getpid()
+    if connection_record.info['pid'] != pid:
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise exc.DisconnectionError(
+            f"Connection opened by process {connection_record.info['pid']} checked out by process {pid}")
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query_time(conn, cursor, statement, parameters, context, executemany):
+    """Add the time spent executing each statement to the `db` phase of the request"""
+    add_phase_time('db', time.perf_counter() - conn.info['query_start'])
+
+
+class QueryCounter:
+    """Records the SQL statements executed inside a `count_queries` block"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None):
+    """Count the SQL statements issued against the engine while the block runs
+
+    Used by the tests to prove that endpoints issue a constant number of queries.
+    """
+    engine = engine or db.engine
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter.record)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter.record)
+
+
+class TableVersion(db.Model):
+    """Version counter for a table, bumped in the same transaction as every write to it
+
+    Lets clients revalidate cached responses (ETags) with a single lookup,
+    instead of re-running the query behind the response.
+    """
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+VERSIONED_TABLES = ['actors', 'movies', 'roles']
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def seed_table_versions(table, connection, **kwargs):
+    connection.execute(table.insert(), [
+        {'name': name, 'version': 0} for name in VERSIONED_TABLES
+    ])
+
+
+# Searching on PostgreSQL uses pg_trgm, which the migrations install. Install it
+# when the tables are created without them too, as the tests do with create_all
+event.listen(db.metadata, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+def bump_table_versions_statement(names):
+    """UPDATE statement incrementing the version of each table in `names`"""
+    table = TableVersion.__table__
+    return table.update().where(table.c.name.in_(sorted(names))).values(
+        version=table.c.version + 1)
+
+
+def bump_table_versions(*names):
+    """Increment the version of each table in `names` in the current transaction"""
+    db.session.execute(bump_table_versions_statement(names))
+
+
+def table_versions_statement(names):
+    """SELECT statement reading the name and version of each table in `names`"""
+    table = TableVersion.__table__
+    return table.select().where(table.c.name.in_(names))
+
+
+def get_table_versions(names):
+    """Returns the current version of each table in `names`, in the same order"""
+    versions = dict(db.session.execute(table_versions_statement(names)).fetchall())
+
+    return [versions.get(name, 0) for name in names]
+
+
+def insert_rows(session, model, rows):
+    """Insert many rows for `model` in `session`, without committing
+
+    Every row must be a dict with the same keys. Returns the ids of the new
+    rows, in the same order as `rows`. Takes the session first, so that the
+    ASGI app can run it with `AsyncSession.run_sync`.
+    """
+    if not rows:
+        return []
+
+    table = model.__table__
+    if session.bind.dialect.name == 'postgresql':
+        result = session.execute(
+            table.insert().values(rows).returning(table.c.id))
+        # ids are drawn from the sequence in VALUES order, so sorting them
+        # lines them back up with the rows
+        ids = sorted(row[0] for row in result)
+    else:
+        objects = [model(**row) for row in rows]
+        session.add_all(objects)
+        session.flush()
+        ids = [obj.id for obj in objects]
+
+    session.execute(bump_table_versions_statement([model.__tablename__]))
+    return ids
+
+
+def bulk_insert(model, rows):
+    """Insert many rows for `model` in a single transaction
+
+    Returns the ids of the new rows, in the same order as `rows`.
+    """
+    ids = insert_rows(db.session, model, rows)
+    db.session.commit()
+    return ids
+
+
+def add_roles(session, movie_id, actor_ids):
+    """Give each of `actor_ids` a role in `movie_id` in `session`, without committing
+
+    Duplicates are detected by the database through the composite primary key
+    of `roles`, so concurrent requests cannot create the same role twice.
+    Returns the set of actor ids that were given a new role.
+    """
+    if not actor_ids:
+        return set()
+
+    table = Role.__table__
+    rows = [{'movie_id': movie_id, 'actor_id': actor_id}
+            for actor_id in actor_ids]
+
+    if session.bind.dialect.name == 'postgresql':
+        statement = postgresql.insert(table).values(
+            rows).on_conflict_do_nothing().returning(table.c.actor_id)
+        added = {row[0] for row in session.execute(statement)}
+    else:
+        statement = table.insert().prefix_with('OR IGNORE', dialect='sqlite')
+        added = {
+            row['actor_id'] for row in rows
+            if session.execute(statement, row).rowcount
+        }
+
+    if added:
+        session.execute(bump_table_versions_statement(['roles']))
+    return added
+
+
+def insert_roles(movie_id, actor_ids):
+    """Give each of `actor_ids` a role in `movie_id` in a single transaction
+
+    Returns the set of actor ids that were given a new role.
+    """
+    added = add_roles(db.session, movie_id, actor_ids)
+    db.session.commit()
+    return added
+
 
 class Actor(db.Model):
     __tablename__ = 'actors'
+    # Sorted pages are read in (sort column, id) order, see helpers.pagination
+    __table_args__ = (
+        db.Index('ix_actors_name_id', 'name', 'id'),
+        db.Index('ix_actors_date_of_birth_id', 'date_of_birth', 'id')
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
-    date_of_birth = db.Column(db.String)
-    gender = db.Column(db.String(10))
+    date_of_birth = db.Column(db.Date)
+    gender = db.Column(db.String(GENDER_MAX_LENGTH), index=True)
 
     movies = db.relationship('Movie', secondary='roles')
 
@@ -43,29 +374,51 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
+        bump_table_versions('actors')
         db.session.commit()
 
     def update(self):
+        bump_table_versions('actors')
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        bump_table_versions('actors', 'roles')
         db.session.commit()
 
-    def format(self):
+    FORMATTERS = {
+        'id': lambda actor: actor.id,
+        'name': lambda actor: actor.name,
+        'date_of_birth': lambda actor: format_date(actor.date_of_birth),
+        'age': lambda actor: years_since_date(actor.date_of_birth),
+        'gender': lambda actor: actor.gender,
+        'movie_count': lambda actor: actor.movie_count
+    }
+    EXPANDERS = {
+        'ids': lambda actor: [m.id for m in actor.movies],
+        'nested': lambda actor: [m.format_self() for m in actor.movies]
+    }
+    FIELDS = tuple(FORMATTERS) + ('movies',)
+    # The count is a subquery for every actor, so it is only returned when
+    # asked for in `fields`
+    DEFAULT_FIELDS = tuple(field for field in FIELDS if field != 'movie_count')
+
+    def format(self, fields=DEFAULT_FIELDS, expand='nested'):
+        """Serialize the actor, with only the attributes named in `fields`
+
+        `expand` is how the `movies` field is returned: `ids` or `nested` objects.
+        Attributes that are not requested are never read, so they do not need to be
+        loaded from the database.
+        """
         return {
-            'id': self.id,
-            'name': self.name,
-            'date_of_birth': self.date_of_birth,
-            'age': years_since_date(self.date_of_birth),
-            'gender': self.gender,
-            'movies': [m.format_self() for m in self.movies]
+            field: self.EXPANDERS[expand](self) if field == 'movies' else self.FORMATTERS[field](self)
+            for field in fields
         }
 
     def format_self(self):
         return {
             'name': self.name,
-            'date_of_birth': self.date_of_birth,
+            'date_of_birth': format_date(self.date_of_birth),
             'age': years_since_date(self.date_of_birth),
             'gender': self.gender
         }
@@ -73,39 +426,67 @@ class Actor(db.Model):
 
 class Movie(db.Model):
     __tablename__ = 'movies'
+    # Sorted pages are read in (sort column, id) order, see helpers.pagination
+    __table_args__ = (
+        db.Index('ix_movies_title_id', 'title', 'id'),
+        db.Index('ix_movies_release_date_id', 'release_date', 'id')
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(), nullable=False)
-    release_date = db.Column(db.String)
+    release_date = db.Column(db.Date)
 
-    actors = db.relationship('Actor', secondary='roles')
+    # The same roles as `Actor.movies`, seen from the other side
+    actors = db.relationship('Actor', secondary='roles', overlaps='movies')
 
     def __repr__(self):
         return f'<Movie {self.id} - {self.title}>'
 
     def insert(self):
         db.session.add(self)
+        bump_table_versions('movies')
         db.session.commit()
 
     def update(self):
+        bump_table_versions('movies')
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        bump_table_versions('movies', 'roles')
         db.session.commit()
 
-    def format(self):
+    FORMATTERS = {
+        'id': lambda movie: movie.id,
+        'title': lambda movie: movie.title,
+        'release_date': lambda movie: format_date(movie.release_date),
+        'actor_count': lambda movie: movie.actor_count
+    }
+    EXPANDERS = {
+        'ids': lambda movie: [a.id for a in movie.actors],
+        'nested': lambda movie: [a.format_self() for a in movie.actors]
+    }
+    FIELDS = tuple(FORMATTERS) + ('actors',)
+    # The count is a subquery for every movie, so it is only returned when
+    # asked for in `fields`
+    DEFAULT_FIELDS = tuple(field for field in FIELDS if field != 'actor_count')
+
+    def format(self, fields=DEFAULT_FIELDS, expand='nested'):
+        """Serialize the movie, with only the attributes named in `fields`
+
+        `expand` is how the `actors` field is returned: `ids` or `nested` objects.
+        Attributes that are not requested are never read, so they do not need to be
+        loaded from the database.
+        """
         return {
-            'id': self.id,
-            'title': self.title,
-            'release_date': self.release_date,
-            'actors': [a.format_self() for a in self.actors]
+            field: self.EXPANDERS[expand](self) if field == 'actors' else self.FORMATTERS[field](self)
+            for field in fields
         }
 
     def format_self(self):
         return {
             'title': self.title,
-            'release_date': self.release_date,
+            'release_date': format_date(self.release_date),
         }
 
 
@@ -120,16 +501,34 @@ class Role(db.Model):
     movie_id = db.Column(
         db.Integer,
         db.ForeignKey('movies.id'),
-        primary_key=True
+        primary_key=True,
+        index=True
     )
 
     def insert(self):
         db.session.add(self)
+        bump_table_versions('roles')
         db.session.commit()
 
     def update(self):
+        bump_table_versions('roles')
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        bump_table_versions('roles')
         db.session.commit()
+
+
+# Counted with a correlated subquery on the roles indexes, rather than by loading
+# every related row. Deferred, so only queries that ask for the count pay for it.
+Actor.movie_count = column_property(
+    select(func.count(Role.movie_id)).where(
+        Role.actor_id == Actor.id).scalar_subquery(),
+    deferred=True
+)
+Movie.actor_count = column_property(
+    select(func.count(Role.actor_id)).where(
+        Role.movie_id == Movie.id).scalar_subquery(),
+    deferred=True
+)
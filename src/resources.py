@@ -0,0 +1,339 @@
+"""Request parsing and query building shared by the Flask app and the ASGI app
+
+Functions take the query string (`args`) or payload they read explicitly, and
+report invalid input with `abort`, which both apps turn into the same JSON
+error responses.
+"""
+from flask import abort
+
+from models import Actor, Movie
+from helpers.dates import convert_date_to_dateobj, convert_dates_to_dateobjs, date_years_ago
+from helpers.fields import EXPAND_OPTIONS, parse_expand, parse_fields
+from helpers.filters import prefix_match
+from helpers.pagination import PAGE_SIZE_MAX, decode_cursor, parse_page_size, parse_sort
+
+
+ACTOR_SORT_COLUMNS = {
+    'id': Actor.id,
+    'name': Actor.name,
+    'date_of_birth': Actor.date_of_birth
+}
+MOVIE_SORT_COLUMNS = {
+    'id': Movie.id,
+    'title': Movie.title,
+    'release_date': Movie.release_date
+}
+
+# The columns each serialized field is built from, so that a `fields` projection
+# only selects what it returns
+ACTOR_FIELD_COLUMNS = {
+    'id': [Actor.id],
+    'name': [Actor.name],
+    'date_of_birth': [Actor.date_of_birth],
+    'age': [Actor.date_of_birth],
+    'gender': [Actor.gender],
+    'movie_count': [Actor.movie_count]
+}
+ACTOR_RELATIONSHIPS = {
+    'movies': (Actor.movies, {
+        'ids': [Movie.id],
+        'nested': [Movie.title, Movie.release_date]
+    })
+}
+MOVIE_FIELD_COLUMNS = {
+    'id': [Movie.id],
+    'title': [Movie.title],
+    'release_date': [Movie.release_date],
+    'actor_count': [Movie.actor_count]
+}
+MOVIE_RELATIONSHIPS = {
+    'actors': (Movie.actors, {
+        'ids': [Actor.id],
+        'nested': [Actor.name, Actor.date_of_birth, Actor.gender]
+    })
+}
+
+SEARCH_TYPES = ['actors', 'movies']
+
+# The oldest age the `min_age` and `max_age` filters accept
+AGE_MAX = 150
+
+
+def get_sort_params(args, sort_columns):
+    """Read the `sort` parameter from the query string
+
+    Returns the column to sort by (None to sort by id), and whether to sort descending.
+    """
+    sort = parse_sort(args.get('sort'), sort_columns)
+    if sort is None:
+        fields = ', '.join(sort_columns)
+        abort(
+            400, description=f'`sort` must be one of: {fields}, optionally prefixed with `-`')
+
+    return sort
+
+
+def get_projection_params(args, model, relationships, default_expand):
+    """Read the `fields` and `expand` parameters from the query string
+
+    Returns the names of the fields of `model` to return (its `DEFAULT_FIELDS` by default),
+    and how its relationships are returned. Relationships are left out of the
+    fields when they are not expanded.
+    """
+    fields = parse_fields(args.get('fields'), model.FIELDS, model.DEFAULT_FIELDS)
+    if fields is None:
+        abort(
+            400, description=f"`fields` must be a comma separated list of: {', '.join(model.FIELDS)}")
+
+    expand = parse_expand(args.get('expand'), default_expand)
+    if expand is None:
+        abort(
+            400, description=f"`expand` must be one of: {', '.join(EXPAND_OPTIONS)}")
+
+    if expand == 'none':
+        fields = [field for field in fields if field not in relationships]
+
+    return fields, expand
+
+
+def get_page_params(args, columns, unpaginated=False):
+    """Read the `limit` and `after` pagination parameters from the query string
+
+    `columns` are the keyset columns the page is ordered by. Returns None for both
+    if the deployment has opted in to `unpaginated` lists and the client did not
+    ask for a page.
+    """
+    limit = args.get('limit')
+    after = args.get('after')
+    if unpaginated and limit is None and after is None:
+        return None, None
+
+    page_size = parse_page_size(limit)
+    if page_size is None:
+        abort(
+            400, description=f'`limit` must be an integer between 1 and {PAGE_SIZE_MAX}')
+
+    cursor = None
+    if after:
+        cursor = decode_cursor(after, columns)
+        if cursor is None:
+            abort(400, description='`after` must be a `next_cursor` returned by a previous request with the same `sort`')
+
+    return page_size, cursor
+
+
+def get_int_arg(args, name, maximum=None):
+    """Read an optional non-negative integer, of at most `maximum` if given, from
+    the query string
+    """
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+
+    description = f'`{name}` must be a non-negative integer'
+    if maximum is not None:
+        description = f'`{name}` must be an integer between 0 and {maximum}'
+
+    try:
+        value = int(value)
+    except ValueError:
+        abort(400, description=description)
+
+    if value < 0 or (maximum is not None and value > maximum):
+        abort(400, description=description)
+
+    return value
+
+
+def get_date_arg(args, name):
+    """Read an optional YYYY-MM-DD date from the query string"""
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+
+    date_value = convert_date_to_dateobj(value)
+    if date_value is None:
+        abort(400, description=f'`{name}` must be in format YYYY-MM-DD')
+
+    return date_value
+
+
+def filter_actors(query, args):
+    """Apply the actor filters in the query string to `query`"""
+    gender = args.get('gender')
+    if gender:
+        query = query.filter(Actor.gender == gender)
+
+    name = args.get('name')
+    if name:
+        query = query.filter(prefix_match(Actor.name, name))
+
+    min_age = get_int_arg(args, 'min_age', AGE_MAX)
+    if min_age is not None:
+        query = query.filter(Actor.date_of_birth <= date_years_ago(min_age))
+
+    max_age = get_int_arg(args, 'max_age', AGE_MAX)
+    if max_age is not None:
+        query = query.filter(
+            Actor.date_of_birth > date_years_ago(max_age + 1))
+
+    return query
+
+
+def filter_movies(query, args):
+    """Apply the movie filters in the query string to `query`"""
+    title = args.get('title')
+    if title:
+        query = query.filter(prefix_match(Movie.title, title))
+
+    release_date_from = get_date_arg(args, 'release_date_from')
+    if release_date_from:
+        query = query.filter(Movie.release_date >= release_date_from)
+
+    release_date_to = get_date_arg(args, 'release_date_to')
+    if release_date_to:
+        query = query.filter(Movie.release_date <= release_date_to)
+
+    return query
+
+
+def stream_requested(args):
+    """Check whether the client asked for the whole collection as a streamed response"""
+    return args.get('stream', '').lower() == 'true'
+
+
+def get_search_params(args):
+    """Read the search text, `type`, `limit` and `offset` parameters of a search"""
+    query = args.get('q', '').strip()
+    if not query:
+        abort(400, description='`q` parameter must be specified')
+
+    search_type = args.get('type')
+    if search_type and search_type not in SEARCH_TYPES:
+        abort(
+            400, description=f"`type` must be one of: {', '.join(SEARCH_TYPES)}")
+
+    limit = parse_page_size(args.get('limit'))
+    if limit is None:
+        abort(
+            400, description=f'`limit` must be an integer between 1 and {PAGE_SIZE_MAX}')
+
+    offset = get_int_arg(args, 'offset') or 0
+
+    return query, search_type, limit, offset
+
+
+def get_bulk_payload(data, max_batch_size):
+    """Check the list of records in the body of a bulk request"""
+    if not isinstance(data, list) or not data:
+        abort(400, description='Payload must be a non-empty list.')
+
+    if len(data) > max_batch_size:
+        abort(
+            400, description=f'Payload must contain at most {max_batch_size} records.')
+
+    return data
+
+
+def get_actor_ids_payload(data, max_batch_size):
+    """Read the distinct `actor_ids` from the body of a bulk role request"""
+    if not isinstance(data, dict) or not isinstance(data.get('actor_ids'), list) or not data['actor_ids']:
+        abort(400, description='`actor_ids` attribute must be a non-empty list')
+
+    # JSON booleans are read as bool, a subclass of int, and are checked before
+    # removing duplicates, as true == 1
+    if not all(isinstance(actor_id, int) and not isinstance(actor_id, bool)
+               for actor_id in data['actor_ids']):
+        abort(400, description='`actor_ids` must only contain integer ids')
+
+    # The size is checked before removing duplicates, so that a request cannot
+    # send any number of ids as long as they repeat
+    if len(data['actor_ids']) > max_batch_size:
+        abort(
+            400, description=f'`actor_ids` must contain at most {max_batch_size} ids')
+
+    return list(dict.fromkeys(data['actor_ids']))
+
+
+def apply_actor_payload(actor, data):
+    """Set the attributes given in a validated actor payload (`POST` or `PATCH`) on `actor`"""
+    if data.get('name'):
+        actor.name = data['name']
+
+    if data.get('date_of_birth'):
+        actor.date_of_birth = convert_date_to_dateobj(data['date_of_birth'])
+
+    if data.get('gender'):
+        actor.gender = data['gender']
+
+    return actor
+
+
+def apply_movie_payload(movie, data):
+    """Set the attributes given in a validated movie payload (`POST` or `PATCH`) on `movie`"""
+    if data.get('title'):
+        movie.title = data['title']
+
+    if data.get('release_date'):
+        movie.release_date = convert_date_to_dateobj(data['release_date'])
+
+    return movie
+
+
+def actor_row(record):
+    """Columns of a new actor, from a validated record of `POST /actors/bulk`"""
+    return {
+        'name': record['name'],
+        'date_of_birth': record.get('date_of_birth'),
+        'gender': record.get('gender') or None
+    }
+
+
+def movie_row(record):
+    """Columns of a new movie, from a validated record of `POST /movies/bulk`"""
+    return {
+        'title': record['title'],
+        'release_date': record.get('release_date')
+    }
+
+
+def prepare_bulk_rows(data, validate, to_row, date_fields=()):
+    """Validate every record in `data`, and convert the valid ones into rows to insert
+
+    `date_fields` are converted from YYYY-MM-DD strings a column at a time.
+    Returns a result for each record, in the same position as the record in the
+    payload, and the rows to insert.
+    """
+    results = []
+    rows = []
+    for index, record in enumerate(data):
+        error = validate(record)
+        if error:
+            results.append({'index': index, 'error': error})
+        else:
+            results.append({'index': index})
+            rows.append(to_row(record))
+
+    for field in date_fields:
+        dates = convert_dates_to_dateobjs([row[field] for row in rows])
+        for row, date_value in zip(rows, dates):
+            row[field] = date_value
+
+    return results, rows
+
+
+def bulk_response(results, ids):
+    """Build the response of a bulk create endpoint, once the rows are inserted
+
+    `ids` are the ids of the inserted rows, in the order they were prepared.
+    """
+    ids = iter(ids)
+    for result in results:
+        if 'error' not in result:
+            result['id'] = next(ids)
+
+    return {
+        'success': True,
+        'created': len([result for result in results if 'id' in result]),
+        'results': results
+    }
@@ -0,0 +1,61 @@
+import threading
+
+from sqlalchemy import event, func, or_
+
+from models import db, Actor, Movie
+from helpers.filters import LIKE_ESCAPE, escape_like
+from helpers.ngram import NGramIndex
+
+
+_memory_indexes = {}
+_memory_indexes_lock = threading.Lock()
+
+
+def get_memory_index(column, session):
+    """Returns the in-memory trigram index over `column`, building it if needed
+
+    Only used when the database is not PostgreSQL (e.g. SQLite in development).
+    The index is per process, and is rebuilt after this process writes to the
+    table. The rows are read without holding the lock, as under the ASGI app
+    the read suspends this task while others run on the same thread.
+    """
+    model = column.class_
+    index = _memory_indexes.get(model)
+    if index is not None:
+        return index
+
+    index = NGramIndex()
+    for key, text in session.query(model.id, column):
+        index.add(key, text)
+
+    with _memory_indexes_lock:
+        return _memory_indexes.setdefault(model, index)
+
+
+def invalidate_memory_index(mapper, connection, target):
+    _memory_indexes.pop(type(target), None)
+
+
+for searchable in (Actor, Movie):
+    for event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(searchable, event_name, invalidate_memory_index)
+
+
+def search_column(column, query, limit, offset=0, session=None):
+    """Rank the rows of a model by how well `column` matches `query`
+
+    On PostgreSQL this uses pg_trgm's word similarity, backed by a GIN trigram
+    index. Returns a list of (id, text, score), best match first.
+    """
+    session = session or db.session
+    if session.bind.dialect.name != 'postgresql':
+        return get_memory_index(column, session).search(query, limit, offset)
+
+    model = column.class_
+    score = func.word_similarity(query, column)
+    rows = session.query(model.id, column, score).filter(or_(
+        column.ilike(f'%{escape_like(query)}%', escape=LIKE_ESCAPE),
+        column.op('%>')(query)
+    )).order_by(score.desc(), model.id).limit(limit).offset(offset)
+
+    return [tuple(row) for row in rows]